@@ -0,0 +1,69 @@
+"""检查周期任务状态计算基准测试，对比逐个计算和线程池并发计算的耗时
+
+只测试任务状态计算和告警列表生成部分（不访问数据库），任务数据在内存中生成，其中包括一个非法crontab表达式的任务。
+在项目根目录下运行：python benchmarks/bench_checkcycle.py [工作线程数] [任务数...]
+"""
+import logging
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cronmon.cache import crontab_next
+from cronmon.main import taskcyclecheck
+
+
+PERIODS = ['* * * * *', '*/5 * * * *', '*/15 * * * *', '*/30 * * * *', '0 * * * *', '25 4 * * *', '3 15 * * *',
+           '15 2 * * *', '30 8 * * 1,3', '* */2 * * *', '* */3 * * *', '45 2 * * *']
+
+
+def make_tasks(count, current_timestamp):
+    """生成任务字典和最新请求时间，约一半任务已到期，其中一部分处于告警状态"""
+    now = datetime.fromtimestamp(current_timestamp)
+    random.seed(0)
+    tasks = []
+    pings = {}
+    for i in range(1, count + 1):
+        due = random.random() < 0.5
+        tasks.append({'id': i, 'name': 'task%d' % i, 'period': random.choice(PERIODS), 'grace_time': 1,
+                      'last_check_time': now - timedelta(minutes=10), 'create_datetime': now - timedelta(days=1),
+                      'next_check_time': now - timedelta(seconds=1) if due else now + timedelta(minutes=5),
+                      'warning': random.random() < 0.05, 'last_ping_time': None,
+                      'emails': ['user%d@cronmon.com' % (i % 100)]})
+        if due and random.random() < 0.9:
+            pings[i] = now - timedelta(minutes=1)
+    tasks[0]['period'] = 'a b c d e'
+    return tasks, pings
+
+
+def bench(count, workers):
+    """运行一次检查周期的状态计算，返回耗时（毫秒）、更新任务数和告警数"""
+    taskcyclecheck.CFG.CHECK_WORKERS = workers
+    taskcyclecheck.POOL = None
+    current_timestamp = int(time.time())
+    tasks, pings = make_tasks(count, current_timestamp)
+    crontab_next.cache_clear()
+    start = time.perf_counter()
+    updates, infolist = taskcyclecheck.evaluate_all(tasks, current_timestamp, pings)
+    elapsed = (time.perf_counter() - start) * 1000
+    if taskcyclecheck.POOL is not None:
+        taskcyclecheck.POOL.shutdown()
+    return elapsed, len(updates), len(infolist)
+
+
+def main():
+    """输出结果"""
+    logging.disable(logging.CRITICAL)
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    counts = [int(i) for i in sys.argv[2:]] or [1000, 10000, 50000]
+    print('workers: %d, chunk: %d, cpus: %d' % (workers, taskcyclecheck.CFG.CHECK_POOL_CHUNK, os.cpu_count()))
+    for count in counts:
+        serial, updates, alerts = bench(count, 0)
+        thread = bench(count, workers)[0]
+        print('%6d tasks (%d updates, %d alerts): serial %.1f ms, thread pool %.1f ms (%.1fx)'
+              % (count, updates, alerts, serial, thread, serial / thread))
+
+
+if __name__ == '__main__':
+    main()
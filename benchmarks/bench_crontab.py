@@ -0,0 +1,59 @@
+"""crontab表达式解析缓存基准测试，对比每个检查周期内逐个任务解析和使用缓存的耗时
+
+在项目根目录下运行：python benchmarks/bench_crontab.py [任务数] [周期数]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crontab import CronTab
+from cronmon.cache import crontab_next, get_crontab
+
+
+PERIODS = ['* * * * *', '*/5 * * * *', '*/15 * * * *', '*/30 * * * *', '0 * * * *', '25 4 * * *', '3 15 * * *',
+           '15 2 * * *', '30 8 * * 1,3', '* */2 * * *', '* */3 * * *', '45 2 * * *']
+
+
+def cycle_uncached(periods, timestamp):
+    """每个任务重新解析crontab表达式"""
+    now = datetime.fromtimestamp(timestamp)
+    for period in periods:
+        CronTab(period).next(now=now, default_utc=False)
+
+
+def cycle_cached(periods, timestamp):
+    """使用crontab_next缓存"""
+    for period in periods:
+        crontab_next(period, timestamp)
+
+
+def bench(func, periods, cycles):
+    """运行指定周期数，返回每个周期平均耗时（毫秒）"""
+    start_timestamp = int(time.time())
+    start = time.perf_counter()
+    for i in range(cycles):
+        timestamp = start_timestamp + i * 60
+        func(periods, timestamp)
+    return (time.perf_counter() - start) * 1000 / cycles
+
+
+def main():
+    """输出结果"""
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    random.seed(0)
+    periods = [random.choice(PERIODS) for _ in range(tasks)]
+
+    uncached = bench(cycle_uncached, periods, cycles)
+    cached = bench(cycle_cached, periods, cycles)
+    print('tasks: %d, distinct periods: %d, cycles: %d' % (tasks, len(set(periods)), cycles))
+    print('uncached: %.2f ms/cycle' % uncached)
+    print('cached:   %.2f ms/cycle (%.1fx)' % (cached, uncached / cached))
+    print('crontab_next: %s' % (crontab_next.cache_info(),))
+    print('get_crontab:  %s' % (get_crontab.cache_info(),))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""空联系人业务检查基准测试，对比逐个用户解析perm_list并逐个查询业务名和关联查询的耗时
+
+使用内存SQLite数据库生成测试数据，不影响配置中的MySQL数据库。
+在项目根目录下运行：python benchmarks/bench_emptybusiness.py [业务数] [用户数] [每个用户业务数]
+"""
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from peewee import SqliteDatabase, fn
+from cronmon.models import BaseModel, User, Permission, Notifier, Business, BusinessNotifier, UserBusiness
+from cronmon.main import taskcyclecheck
+
+
+def setup(businesses, users, per_user):
+    """生成测试数据，约一半业务没有联系人"""
+    db = SqliteDatabase(':memory:')
+    models = BaseModel.__subclasses__()
+    db.bind(models, bind_refs=False, bind_backrefs=False)
+    db.connect()
+    db.create_tables(models)
+    random.seed(0)
+    with db.atomic():
+        Business.insert_many([('biz%d' % i, True) for i in range(businesses)],
+                             fields=[Business.business_name, Business.status]).execute()
+        Notifier.insert(notify_name='nfy', notify_email='nfy@cronmon.com', notify_tel='13900000000').execute()
+        for i in range(0, businesses, 1000):
+            BusinessNotifier.insert_many([(bid, 1) for bid in range(i + 1, min(i + 1000, businesses) + 1)
+                                          if bid % 2], fields=[BusinessNotifier.business, BusinessNotifier.notifier])\
+                .execute()
+        for i in range(users):
+            user = User.create(username='user%d' % i, password='pwd', email='user%d@cronmon.com' % i,
+                               phone='1390000%04d' % i, admin=i < 10)
+            if user.admin:
+                Permission.create(perm_user=user, perm_list='0')
+                continue
+            bids = random.sample(range(1, businesses + 1), per_user)
+            Permission.create(perm_user=user, perm_list=' '.join(str(bid) for bid in bids))
+            UserBusiness.insert_many([(user.id, bid) for bid in bids],
+                                     fields=[UserBusiness.user, UserBusiness.business]).execute()
+    return db
+
+
+def legacy_bizadmin(infolist):
+    """原实现（业务管理员部分）：逐个用户解析perm_list，在Python中交叉比对后逐个查询业务名"""
+    subq = BusinessNotifier.select().where(BusinessNotifier.business_id == Business.id)
+    stridlist = [str(i.id) for i in Business.select().where((~fn.EXISTS(subq)) & (Business.status == True))]
+    strlist = []
+    user_perm_list = Permission.select().join(User)\
+        .where((Permission.perm_list != '0') & (Permission.perm_list != '') & (User.status == 1))
+    for item in user_perm_list:
+        business_intersection = [x for x in item.perm_list.split() if x in set(stridlist)]
+        if business_intersection:
+            for perm_item in business_intersection:
+                strlist.append(Business.select().where(Business.id == perm_item).get().business_name)
+            infolist.append([item.perm_user.email, "\n".join(strlist), 'Empty Business - BizAdmin'])
+
+
+def current(infolist):
+    """当前实现"""
+    taskcyclecheck.send_alerts = infolist.extend
+    taskcyclecheck.emptybusinesscheck()
+
+
+def bench(func):
+    """运行一次，返回耗时（毫秒）和生成的邮件数"""
+    infolist = []
+    start = time.perf_counter()
+    func(infolist)
+    return (time.perf_counter() - start) * 1000, len(infolist)
+
+
+def main():
+    """输出结果"""
+    businesses = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    per_user = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    setup(businesses, users, per_user)
+
+    legacy, legacy_mails = bench(legacy_bizadmin)
+    new, new_mails = bench(current)
+    print('businesses: %d, users: %d, businesses per user: %d' % (businesses, users, per_user))
+    print('legacy (bizadmin only): %.1f ms, %d mails' % (legacy, legacy_mails))
+    print('current (all):          %.1f ms, %d mails (%.1fx)' % (new, new_mails, legacy / new))
+
+
+if __name__ == '__main__':
+    main()
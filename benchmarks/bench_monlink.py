@@ -0,0 +1,134 @@
+"""监控url请求压力测试，对比flask请求处理流程和WSGI快速通道（MONLINK_FAST_PATH）每秒可处理的请求数
+
+默认在进程内直接调用WSGI app（单个worker的处理能力，不包括网络开销），使用临时SQLite数据库，
+开启MONLINK_BUFFER缓冲写入，监控url随机分布在全部任务中，另有少量错误uuid请求。
+指定URL时改为对运行中的服务进行HTTP压力测试（keep-alive连接），例如：
+python benchmarks/bench_monlink.py --url http://127.0.0.1:5000/api/monlink/<uuid> --concurrency 50
+
+在项目根目录下运行：python benchmarks/bench_monlink.py [请求数] [任务数]
+"""
+import argparse
+import http.client
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup(tasks):
+    """创建临时SQLite数据库和任务数据，返回flask app、快速通道app和监控url列表"""
+    import logging
+    from peewee import SqliteDatabase
+    from cronmon import create_app
+    from cronmon.models import BaseModel, Business, TaskMonitor
+    from cronmon.api import ping
+    from cronmon.api.fastpath import MonlinkMiddleware
+
+    logging.disable(logging.CRITICAL)
+    db = SqliteDatabase(os.path.join(tempfile.mkdtemp(), 'bench.db'), pragmas={'journal_mode': 'wal'})
+    models = BaseModel.__subclasses__()
+    db.bind(models, bind_refs=False, bind_backrefs=False)
+    db.create_tables(models)
+    # SQLite没有GREATEST函数，最新请求时间改为不更新（只测试请求处理开销）
+    ping.update_last_ping = lambda latest: None
+    ping.DB = db
+    ping.CFG.MONLINK_BUFFER = True
+
+    business = Business.create(business_name='bench')
+    urls = [TaskMonitor.gen_uuid() for _ in range(tasks)]
+    with db.atomic():
+        for i in range(0, tasks, 500):
+            TaskMonitor.insert_many([(url, 'task-' + url, '* * * * *', business.id) for url in urls[i:i + 500]],
+                                    fields=[TaskMonitor.url, TaskMonitor.name, TaskMonitor.period,
+                                            TaskMonitor.business]).execute()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    fast = MonlinkMiddleware(app)
+    return app, fast, urls, ping.PING_WRITER
+
+
+def make_environ(url):
+    """生成WSGI environ"""
+    return {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/monlink/' + url, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '10.0.0.1', 'HTTP_USER_AGENT': 'curl/7.29.0', 'HTTP_HOST': 'localhost',
+            'wsgi.url_scheme': 'http', 'wsgi.input': None, 'wsgi.errors': sys.stderr, 'wsgi.version': (1, 0),
+            'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False}
+
+
+def bench_wsgi(app, paths):
+    """进程内调用WSGI app，返回每秒请求数和各状态码数量"""
+    statuses = {}
+
+    def start_response(status, headers):
+        statuses[status] = statuses.get(status, 0) + 1
+
+    environs = [make_environ(path) for path in paths]
+    start = time.perf_counter()
+    for environ in environs:
+        b''.join(app(dict(environ), start_response))
+    return len(paths) / (time.perf_counter() - start), statuses
+
+
+def bench_http(url, requests, concurrency):
+    """对运行中的服务进行HTTP压力测试，每个线程使用一个keep-alive连接，返回每秒请求数和各状态码数量"""
+    parts = urlsplit(url)
+    conn_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(count):
+        conn = conn_class(parts.netloc, timeout=10)
+        for _ in range(count):
+            conn.request('GET', parts.path, headers={'User-Agent': 'cronmon-bench'})
+            response = conn.getresponse()
+            response.read()
+            with lock:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(requests // concurrency,)) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(statuses.values()) / (time.perf_counter() - start), statuses
+
+
+def main():
+    """输出结果"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('requests', type=int, nargs='?', default=20000)
+    parser.add_argument('tasks', type=int, nargs='?', default=1000)
+    parser.add_argument('--url', help='对运行中的服务进行HTTP压力测试的监控url')
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.url:
+        rate, statuses = bench_http(args.url, args.requests, args.concurrency)
+        print('%s: %.0f req/s %s' % (args.url, rate, statuses))
+        return
+
+    app, fast, urls, writer = setup(args.tasks)
+    random.seed(0)
+    paths = [random.choice(urls) if random.random() < 0.99 else 'f9e05ae0-43d2-4753-823a-wrong'
+             for _ in range(args.requests)]
+    # 预热uuid缓存
+    bench_wsgi(fast, urls)
+    writer.flush()
+
+    flask_rate, flask_statuses = bench_wsgi(app.wsgi_app, paths)
+    writer.flush()
+    fast_rate, fast_statuses = bench_wsgi(fast, paths)
+    writer.flush()
+    print('requests: %d, tasks: %d' % (args.requests, args.tasks))
+    print('flask:     %8.0f req/s %s' % (flask_rate, flask_statuses))
+    print('fast path: %8.0f req/s %s (%.1fx)' % (fast_rate, fast_statuses, fast_rate / flask_rate))
+
+
+if __name__ == '__main__':
+    main()
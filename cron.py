@@ -1,18 +1,29 @@
 import os
-from cronmon import create_app, scheduler
+from cronmon import create_app, scheduler, get_logger
+from cronmon.email import init_mail_app
+from cronmon.lease import LeaderElection, leader_jobs
+from cronmon.main.deadline import DEADLINE_QUEUE
 
-# 创建app
+LOGGER = get_logger(__name__)
+
+# 创建app，后台任务发送邮件时复用此app
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+init_mail_app(app)
 
-# scheduler初始化和启动
+# scheduler初始化和启动，开启主节点选举时主节点任务先暂停，获得租约后恢复（分片检查模式下检查任务在每个节点运行）
 scheduler.init_app(app)
+if app.config['SCHEDULER_LEASE']:
+    LeaderElection(scheduler, leader_jobs()).start()
 scheduler.start()
 
-# 判断是否运行在uwsgi模式下，然后阻塞mule等待uwsgi信号
+# 判断是否运行在uwsgi模式下，然后阻塞mule等待uwsgi信号和mule消息（任务变化通知，用于'deadline'检查模式）
 try:
     import uwsgi
     while True:
-        sig = uwsgi.signal_wait()
-        print(sig)
+        msg = uwsgi.mule_get_msg()
+        try:
+            DEADLINE_QUEUE.touch(msg.decode())
+        except Exception as err:
+            LOGGER.error('Invalid mule message %r: %s', msg, err)
 except Exception as err:
     pass
@@ -39,6 +39,21 @@ def create_app(config_name):
     login_manager.init_app(app)
     moment.init_app(app)
 
+    # 连接池模式下每个请求开始时从连接池获取连接，请求结束后放回连接池
+    if app.config['DB_POOL']:
+        from .models import DB
+
+        @app.before_request
+        def db_connect():
+            """获取数据库连接"""
+            DB.connect(reuse_if_open=True)
+
+        @app.teardown_request
+        def db_close(exc):
+            """将数据库连接放回连接池"""
+            if not DB.is_closed():
+                DB.close()
+
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
@@ -51,4 +66,9 @@ def create_app(config_name):
     from .api.api_1_0 import api_1_0 as api_1_0_blueprint
     app.register_blueprint(api_1_0_blueprint, url_prefix='/api/v1.0')
 
+    # 监控url请求快速通道，挂载在flask请求处理流程之前
+    if app.config['MONLINK_FAST_PATH']:
+        from .api.fastpath import MonlinkMiddleware
+        app.wsgi_app = MonlinkMiddleware(app)
+
     return app
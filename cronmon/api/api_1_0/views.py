@@ -1,15 +1,38 @@
 import math
+from datetime import datetime
 from flask import request, g, url_for, jsonify
 from cronmon import get_logger, get_config
-from cronmon.api.errors import bad_request
-from cronmon.models import TaskMonitor, Permission, Business, ApiRequestLog
-from cronmon.utils import list_gen
+from cronmon.api.errors import bad_request, forbidden
+from cronmon.api.ping import TASK_CACHE, PING_WRITER
+from cronmon.batchwriter import BatchWriter, DB_RETRY_ERRORS, db_sink, jsonl_sink
+from cronmon.cache import LRUCache
+from cronmon.models import DB, TaskMonitor, Business, ApiRequestLog
+from cronmon.perm import SUPERUSER_PERM, get_perm_list, perm_business
+from cronmon.serializers import TASK_ITEM, API_TASK_ITEM
+from cronmon.utils import encode_cursor, decode_cursor
 from cronmon.exceptions import ValidationError
 from . import api_1_0
 
 LOGGER = get_logger(__name__)
 CFG = get_config()
 
+# 接口请求日志写缓冲，根据API_LOG_MODE写入数据库（'db'）或JSON Lines文件（'file'），'off'为不记录
+API_LOG_FIELDS = [ApiRequestLog.client_ip, ApiRequestLog.user_agent, ApiRequestLog.url, ApiRequestLog.method,
+                  ApiRequestLog.code, ApiRequestLog.user_id, ApiRequestLog.create_datetime]
+if CFG.API_LOG_MODE == 'db':
+    API_LOG_SINK, API_LOG_RETRY = db_sink(ApiRequestLog, API_LOG_FIELDS), DB_RETRY_ERRORS
+elif CFG.API_LOG_MODE == 'file':
+    API_LOG_SINK, API_LOG_RETRY = jsonl_sink(CFG.API_LOG_FILE, [field.name for field in API_LOG_FIELDS]), (OSError,)
+else:
+    API_LOG_SINK, API_LOG_RETRY = None, ()
+API_LOG_WRITER = BatchWriter(API_LOG_SINK, CFG.API_LOG_BATCH, CFG.API_LOG_INTERVAL, CFG.API_LOG_MAX, 'drop',
+                             'apilog-writer', API_LOG_RETRY) if API_LOG_SINK else None
+
+# 任务记录数缓存，以用户业务权限为键
+COUNT_CACHE = LRUCache(1024, CFG.API_COUNT_CACHE_TTL)
+# 游标分页时额外查询任务id用于生成下页游标（输出前去除）
+API_TASK_CURSOR_ITEM = API_TASK_ITEM.extend(('cursor', TaskMonitor.id))
+
 
 @api_1_0.after_request
 def after_request(response):
@@ -29,38 +52,45 @@ def after_request(response):
     # msg = ' - '.join((client_ip, method, url, code, user_agent, user_id))
     # LOGGER.info(msg)
 
-    toadd = ApiRequestLog()
-    toadd.client_ip = client_ip
-    toadd.user_agent = user_agent
-    toadd.url = url
-    toadd.method = method
-    toadd.code = code
-    toadd.user_id = user_id
-    toadd.save()
+    # 写入缓冲，由后台线程批量写入数据库或文件（API_LOG_MODE为'off'时不记录）
+    if API_LOG_WRITER:
+        API_LOG_WRITER.add((client_ip, user_agent, url, method, code, user_id, datetime.now()))
 
     return response
 
 
+def tasks_count(query, perm_list):
+    """获取任务记录数（按用户业务权限缓存API_COUNT_CACHE_TTL秒）"""
+    total_count = COUNT_CACHE.get(perm_list)
+    if total_count is None:
+        total_count = query.count()
+        COUNT_CACHE.set(perm_list, total_count)
+    return total_count
+
+
 @api_1_0.route('/tasks/all', methods=['GET'])
 def tasks_all():
     """获取全部监控任务请求接口
 
     请求参数包括page（页码）和length（每页显示记录数），根据api用户对应业务权限进行过滤
+    如果请求参数包括after（游标，首页为空值），则按任务id游标分页，此时count参数为1才返回记录数
 
     :return: json格式输出，包括tasks（任务信息）、prev（上页url）、next（下页url）和count（记录数）
     """
 
     page = int(request.args.get('page')) if request.args.get('page') else 1
     length = int(request.args.get('length')) if request.args.get('length') else CFG.ITEMS_PER_PAGE
-    perm_list = Permission.select().where(Permission.perm_user == g.current_user.id).get().perm_list.split()
+    perm_list = get_perm_list(g.current_user.id)
 
-    if perm_list == ['0']:
-        query = TaskMonitor.select().order_by(TaskMonitor.id)
-    else:
-        query = TaskMonitor.select().join(Business).where(Business.id.in_(perm_list)).order_by(TaskMonitor.id)
+    query = TaskMonitor.select().join(Business).order_by(TaskMonitor.id)
+    if perm_list != SUPERUSER_PERM:
+        query = query.where(Business.id.in_(perm_business(g.current_user.id)))
+
+    if 'after' in request.args:
+        return tasks_all_cursor(query, perm_list, length)
 
     # 对page、length和返回记录数进行有效性检查
-    total_count = query.count()
+    total_count = tasks_count(query, perm_list)
 
     if total_count == 0:
         return bad_request("No Records")
@@ -85,17 +115,55 @@ def tasks_all():
     if page:
         query = query.paginate(page, length)
 
-    item = "{'name': obj.name, 'url': obj.url, 'period': obj.period, 'grace_time': obj.grace_time," \
-           "'status': obj.status, 'warning': obj.warning, 'business_name': obj.business.business_name}"
-
     return jsonify({
-        'tasks': list_gen(query, item),
+        'tasks': API_TASK_ITEM(query),
         'prev': prev,
         'next': next,
         'count': total_count
     })
 
 
+def tasks_all_cursor(query, perm_list, length):
+    """全部监控任务游标分页，按主键定位起始位置，不需要扫描之前的记录
+
+    :param query: 按任务id排序的查询语句
+    :param perm_list: 用户业务权限
+    :param length: 每页显示记录数
+    :return: json格式输出，prev始终为None，next为下页url（包括下页游标），无下页则为None
+    """
+    try:
+        cursor = decode_cursor(request.args.get('after'))
+        after = int(cursor[0]) if cursor else 0
+    except ValueError:
+        return bad_request("Invalid Cursor")
+
+    if length < 1:
+        return bad_request("Out of Range")
+
+    # 多取一条记录用于判断是否存在下页
+    rows = API_TASK_CURSOR_ITEM(query.where(TaskMonitor.id > after).limit(length + 1))
+    if not rows:
+        return bad_request("No Records")
+
+    next = None
+    if len(rows) > length:
+        rows = rows[:length]
+        next = url_for("api_1_0.tasks_all", after=encode_cursor(rows[-1]['cursor']), length=length, _external=True)
+    for row in rows:
+        del row['cursor']
+
+    total_count = None
+    if request.args.get('count') == '1':
+        total_count = tasks_count(query, perm_list)
+
+    return jsonify({
+        'tasks': rows,
+        'prev': None,
+        'next': next,
+        'count': total_count
+    })
+
+
 @api_1_0.route('/tasks', methods=['GET'])
 def tasks_filter():
     """根据请求参数获取监控任务请求接口
@@ -108,34 +176,47 @@ def tasks_filter():
     bizname = request.args.get('bizname')
     url = request.args.get('url')
     taskname = request.args.get('taskname')
-    perm_list = Permission.select().where(Permission.perm_user == g.current_user.id).get().perm_list.split()
+    perm_list = get_perm_list(g.current_user.id)
 
     # 对参数名称、参数个数和返回记录数进行有效性检查
     if len(request.args) > 1 or len(request.args) == 0:
         return bad_request("Only One Keyword Allowed")
     elif bizname:
-        query = TaskMonitor.select().join(Business)\
-            .where(((perm_list == ['0']) & (Business.business_name == bizname)) |
-                   ((Business.id.in_(perm_list)) & (Business.business_name == bizname)))
+        query = TaskMonitor.select().join(Business).where(Business.business_name == bizname)
     elif url:
-        query = TaskMonitor.select().join(Business).where(((perm_list == ['0']) & (TaskMonitor.url == url)) |
-                                                          ((Business.id.in_(perm_list)) & (TaskMonitor.url == url)))
+        query = TaskMonitor.select().join(Business).where(TaskMonitor.url == url)
     elif taskname:
-        query = TaskMonitor.select().join(Business)\
-            .where(((perm_list == ['0']) & (TaskMonitor.name == taskname)) |
-                   ((Business.id.in_(perm_list)) & (TaskMonitor.name == taskname)))
+        query = TaskMonitor.select().join(Business).where(TaskMonitor.name == taskname)
     else:
         return bad_request("Keyword Doesn't Exist")
 
+    if perm_list != SUPERUSER_PERM:
+        query = query.where(Business.id.in_(perm_business(g.current_user.id)))
+
     if query.count() == 0:
         return bad_request("No Records")
 
-    item = "{'warning': obj.warning, 'name': obj.name, 'id': obj.id, 'url': obj.url, 'period': obj.period," \
-           "'grace_time': obj.grace_time,'status': obj.status, 'business_name': obj.business.business_name, " \
-           "'bid': obj.business.id}"
+    return jsonify({
+        'tasks': TASK_ITEM(query)
+    })
+
+
+@api_1_0.route('/stats', methods=['GET'])
+def stats():
+    """获取当前进程运行统计信息请求接口，只允许超级管理员（业务权限为0）访问
+
+    :return: json格式输出，包括db_pool（数据库连接池，未开启连接池则为None）、monlink_cache（监控url缓存）、
+             monlink_writer（监控请求日志写缓冲）和apilog_writer（接口请求日志写缓冲）
+    """
+    perm_list = get_perm_list(g.current_user.id)
+    if perm_list != SUPERUSER_PERM:
+        return forbidden('Superuser only')
 
     return jsonify({
-        'tasks': list_gen(query, item)
+        'db_pool': DB.pool_stats() if CFG.DB_POOL else None,
+        'monlink_cache': TASK_CACHE.stats(),
+        'monlink_writer': PING_WRITER.stats(),
+        'apilog_writer': API_LOG_WRITER.stats() if API_LOG_WRITER else None
     })
 
 
@@ -0,0 +1,65 @@
+import json
+import re
+from cronmon import get_config
+from cronmon.api.errors import bad_request
+from cronmon.api.ping import task_lookup, record_ping
+from cronmon.models import DB
+
+
+CFG = get_config()
+PREFIX = '/api/monlink/'
+# 与flask接口一致不区分大小写（数据库查询不区分大小写）
+UUID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+# 与cronmon/api/views.py中monlink接口相同的响应，BAD_BODY为DEBUG关闭时flask.jsonify的输出格式（cronmon-ingest使用），
+# MonlinkMiddleware中的错误响应按app的JSON配置生成
+OK_BODY = b'OK'
+OK_HEADERS = [('Content-Type', 'text/html; charset=utf-8'), ('Content-Length', str(len(OK_BODY)))]
+BAD_BODY = (json.dumps({'error': 'Bad Request', 'message': 'Wrong Id'}, separators=(',', ':'), sort_keys=True)
+            + '\n').encode()
+BAD_HEADERS = [('Content-Type', 'application/json'), ('Content-Length', str(len(BAD_BODY)))]
+
+
+class MonlinkMiddleware(object):
+    """监控url请求的WSGI快速通道，挂载在flask app之前（MONLINK_FAST_PATH开启时）
+
+    只处理'GET/HEAD /api/monlink/<uuid>'请求：校验uuid格式、查询任务（缓存）、记录请求，
+    不经过flask的路由分发、请求对象、user_agent解析和请求钩子，其他请求交给flask app处理
+    """
+
+    def __init__(self, app):
+        """
+        :param app: flask app，错误响应内容由app的bad_request生成（DEBUG开启时jsonify输出带缩进）
+        """
+        self.app = app.wsgi_app
+        with app.app_context():
+            response = bad_request('Wrong Id')
+        self.bad_body = response.get_data()
+        self.bad_headers = [('Content-Type', response.content_type), ('Content-Length', str(len(self.bad_body)))]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        method = environ.get('REQUEST_METHOD')
+        cronuuid = path[len(PREFIX):]
+        if not path.startswith(PREFIX) or method not in ('GET', 'HEAD') or not cronuuid or '/' in cronuuid:
+            return self.app(environ, start_response)
+
+        ok = False
+        try:
+            if UUID_PATTERN.match(cronuuid):
+                mon_id = task_lookup(cronuuid)[0]
+                record_ping(mon_id, str(environ.get('REMOTE_ADDR')), environ.get('HTTP_USER_AGENT', ''))
+                ok = True
+        except Exception:
+            pass
+        finally:
+            # 连接池模式下将连接放回连接池（缓存命中且缓冲写入时不会获取连接）
+            if CFG.DB_POOL and not DB.is_closed():
+                DB.close()
+
+        if ok:
+            start_response('200 OK', list(OK_HEADERS))
+            body = OK_BODY
+        else:
+            start_response('400 BAD REQUEST', list(self.bad_headers))
+            body = self.bad_body
+        return [b''] if method == 'HEAD' else [body]
@@ -0,0 +1,119 @@
+from datetime import datetime
+from peewee import fn, Case
+from cronmon import get_config
+from cronmon.batchwriter import BatchWriter, DB_RETRY_ERRORS, db_sink
+from cronmon.cache import LRUCache
+from cronmon.models import DB, TaskMonitor, TaskMonitorLog
+
+
+CFG = get_config()
+
+# 监控url（uuid部分）到（任务id，任务状态）的进程内缓存，不存在的uuid以None缓存（负缓存）
+# 每个worker进程各自持有一份，其他进程中的修改依赖TTL过期
+TASK_CACHE = LRUCache(CFG.MONLINK_CACHE_SIZE, CFG.MONLINK_CACHE_TTL)
+
+# 监控请求日志写缓冲（MONLINK_BUFFER开启时使用）
+PING_FIELDS = [TaskMonitorLog.taskmon_id, TaskMonitorLog.client_ip, TaskMonitorLog.user_agent,
+               TaskMonitorLog.create_datetime]
+PING_LOG_SINK = db_sink(TaskMonitorLog, PING_FIELDS)
+
+
+def update_last_ping(latest):
+    """更新任务最新请求时间，只在新的请求时间更晚时更新（GREATEST），多个任务合并为一条UPDATE语句
+
+    :param latest: 任务id为键，请求时间为值的字典
+    :return: 无
+    """
+    if not latest:
+        return
+    ping_time = Case(TaskMonitor.id, list(latest.items()))
+    TaskMonitor.update(last_ping_time=fn.GREATEST(fn.COALESCE(TaskMonitor.last_ping_time, ping_time), ping_time))\
+        .where(TaskMonitor.id.in_(list(latest))).execute()
+
+
+def ping_query(task_ids, since):
+    """任务在指定时间之后的最新请求时间查询，只读取(taskmon_id, create_datetime)索引
+
+    :param task_ids: 任务id列表
+    :param since: 时间下限（不包括）
+    :return: 查询语句，结果为(任务id, 最新请求时间)元组
+    """
+    return TaskMonitorLog\
+        .select(TaskMonitorLog.taskmon_id, fn.MAX(TaskMonitorLog.create_datetime))\
+        .where(TaskMonitorLog.taskmon_id.in_(task_ids), TaskMonitorLog.create_datetime > since)\
+        .group_by(TaskMonitorLog.taskmon_id)\
+        .tuples()
+
+
+def ping_sink(rows):
+    """批量写入监控请求日志，并在同一事务中按任务合并更新最新请求时间"""
+    latest = {}
+    for mon_id, client_ip, user_agent, create_datetime in rows:
+        if mon_id not in latest or latest[mon_id] < create_datetime:
+            latest[mon_id] = create_datetime
+    with DB.atomic():
+        PING_LOG_SINK(rows)
+        update_last_ping(latest)
+
+
+PING_WRITER = BatchWriter(ping_sink, CFG.MONLINK_BUFFER_ROWS, CFG.MONLINK_BUFFER_INTERVAL, CFG.MONLINK_BUFFER_MAX,
+                          CFG.MONLINK_BUFFER_OVERFLOW, 'monlink-writer', DB_RETRY_ERRORS)
+
+
+def ping_row(mon_id, client_ip, user_agent):
+    """生成一条监控请求日志记录，客户端ip和客户端类型截断到字段长度（超长时MySQL严格模式下写入失败）
+
+    :param mon_id: 任务id
+    :param client_ip: 客户端ip
+    :param user_agent: 客户端类型
+    :return: (任务id, 客户端ip, 客户端类型, 请求时间)
+    """
+    return (mon_id, client_ip[:TaskMonitorLog.client_ip.max_length],
+            user_agent[:TaskMonitorLog.user_agent.max_length], datetime.now())
+
+
+def task_lookup(cronuuid):
+    """根据监控url获取任务信息，优先读取缓存
+
+    :param cronuuid: 监控url（uuid部分），不区分大小写（缓存以小写为键）
+    :return: (任务id, 任务状态)，如果不存在此uuid，则返回None
+    """
+    key = cronuuid.lower()
+    task = TASK_CACHE.get(key, False)
+    if task is not False:
+        return task
+
+    try:
+        obj = TaskMonitor.select(TaskMonitor.id, TaskMonitor.status).where(TaskMonitor.url == cronuuid).get()
+        task = (obj.id, obj.status)
+    except TaskMonitor.DoesNotExist:
+        task = None
+    TASK_CACHE.set(key, task)
+    return task
+
+
+def task_invalidate(*cronuuids):
+    """使指定监控url的缓存失效，不传参数则清空全部缓存"""
+    if not cronuuids:
+        TASK_CACHE.clear()
+    for cronuuid in cronuuids:
+        TASK_CACHE.pop(cronuuid.lower())
+
+
+def record_ping(mon_id, client_ip, user_agent):
+    """记录一次监控请求，开启MONLINK_BUFFER时写入缓冲批量入库，否则直接写入数据库
+
+    :param mon_id: 任务id
+    :param client_ip: 客户端ip
+    :param user_agent: 客户端类型
+    :return: 无
+    """
+    row = ping_row(mon_id, client_ip, user_agent)
+    if CFG.MONLINK_BUFFER:
+        PING_WRITER.add(row)
+        return
+
+    toadd = TaskMonitorLog()
+    toadd.taskmon_id, toadd.client_ip, toadd.user_agent, toadd.create_datetime = row
+    toadd.save()
+    update_last_ping({mon_id: toadd.create_datetime})
@@ -1,6 +1,6 @@
 from flask import request
-from cronmon.models import TaskMonitor, TaskMonitorLog
 from cronmon.api.errors import bad_request
+from cronmon.api.ping import task_lookup, record_ping
 from cronmon.exceptions import ValidationError
 from . import api
 
@@ -13,15 +13,11 @@ def monlink(cronuuid):
     :return: 如果存在此uuid，则返回‘OK’，反之则返回‘BAD REQUEST’
     """
     try:
-        mon_id = TaskMonitor.select().where(TaskMonitor.url == cronuuid).get().id
+        mon_id = task_lookup(cronuuid)[0]
 
         client_ip = str(request.remote_addr)
         user_agent = request.user_agent.string
-        toadd = TaskMonitorLog()
-        toadd.taskmon_id = mon_id
-        toadd.client_ip = client_ip
-        toadd.user_agent = user_agent
-        toadd.save()
+        record_ping(mon_id, client_ip, user_agent)
         return 'OK'
     except:
         return bad_request("Wrong Id")
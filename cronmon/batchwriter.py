@@ -0,0 +1,208 @@
+import atexit
+import json
+from collections import deque
+import os
+import threading
+from peewee import OperationalError, InterfaceError
+from cronmon import get_logger
+
+
+LOGGER = get_logger(__name__)
+# 数据库写入时可重试的异常（连接中断等），记录放回缓冲等待下次写入
+DB_RETRY_ERRORS = (OperationalError, InterfaceError)
+
+
+def at_shutdown(func):
+    """注册进程退出时执行的函数（uwsgi模式下同时挂载到uwsgi.atexit）
+
+    :param func: 进程退出时执行的函数
+    :return: 无
+    """
+    atexit.register(func)
+    try:
+        import uwsgi
+    except ImportError:
+        return
+    prev = getattr(uwsgi, 'atexit', None)
+
+    def chained():
+        """先执行当前函数，再执行之前已注册的函数"""
+        func()
+        if prev:
+            prev()
+    uwsgi.atexit = chained
+
+
+def db_sink(model, fields, chunk_size=1000):
+    """生成数据库批量写入函数，每次写入在一个事务中完成
+
+    :param model: 数据库model
+    :param fields: 写入字段列表，和每条记录元组一一对应
+    :param chunk_size: 单条insert语句最大记录数
+    :return: 写入函数
+    """
+    def sink(rows):
+        """通过insert_many批量写入"""
+        with model._meta.database.atomic():
+            for i in range(0, len(rows), chunk_size):
+                model.insert_many(rows[i:i + chunk_size], fields=fields).execute()
+    return sink
+
+
+def jsonl_sink(path, keys):
+    """生成JSON Lines文件批量写入函数
+
+    :param path: 文件路径
+    :param keys: 字段名列表，和每条记录元组一一对应
+    :return: 写入函数
+    """
+    def sink(rows):
+        """每条记录写为一行JSON"""
+        lines = [json.dumps(dict(zip(keys, row)), default=str, ensure_ascii=False) for row in rows]
+        with open(path, 'a', encoding='utf8') as f:
+            f.write('\n'.join(lines) + '\n')
+    return sink
+
+
+class BatchWriter(object):
+    """写缓冲，在内存中累积记录，达到指定条数或时间间隔后批量写入"""
+
+    def __init__(self, sink, batch_size=500, interval=1000, max_size=10000, overflow='block', name='batchwriter',
+                 retry_errors=()):
+        """
+        :param sink: 批量写入函数，参数为记录列表
+        :param batch_size: 累积到此条数时唤醒后台线程写入
+        :param interval: 后台线程写入间隔（毫秒）
+        :param max_size: 缓冲最大记录数
+        :param overflow: 缓冲已满时的处理方式，'block'为在当前请求中同步写入，'drop'为丢弃新记录
+        :param name: 名称，用于日志和后台线程名
+        :param retry_errors: 可重试的异常类型（如数据库连接异常），出现时记录放回缓冲等待下次写入，
+            其他异常按二分拆分重新写入，单条仍写入失败的记录丢弃
+        """
+        self.sink = sink
+        self.retry_errors = tuple(retry_errors)
+        self.batch_size = batch_size
+        self.interval = interval / 1000.0
+        self.max_size = max_size
+        self.overflow = overflow
+        self.name = name
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rejected = 0
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._pid = None
+
+    def start(self):
+        """启动后台写入线程（fork之后的子进程中需重新启动，因此按pid判断）"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = False
+        thread = threading.Thread(target=self._run, name=self.name)
+        thread.daemon = True
+        thread.start()
+        at_shutdown(self.stop)
+
+    def _run(self):
+        """后台写入循环"""
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def add(self, row, block=True):
+        """添加一条记录
+
+        :param row: 记录元组
+        :param block: 缓冲已满时是否在当前线程同步写入后重试，为False时直接返回False（不计入dropped，由调用方处理）
+        :return: 是否成功加入缓冲，缓冲已满且无法写入时返回False
+        """
+        if self._pid != os.getpid():
+            self.start()
+
+        with self._lock:
+            if len(self._rows) < self.max_size:
+                self._rows.append(row)
+                if len(self._rows) >= self.batch_size:
+                    self._wakeup.set()
+                return True
+            if self.overflow == 'drop':
+                self.dropped += 1
+                return False
+            if not block:
+                return False
+
+        # 缓冲已满，在当前请求中同步写入后重试一次
+        self.flush()
+        with self._lock:
+            if len(self._rows) < self.max_size:
+                self._rows.append(row)
+                return True
+            self.dropped += 1
+            return False
+
+    def _write(self, rows):
+        """写入记录，写入失败时二分拆分后分别重新写入，单条仍写入失败的记录丢弃（计入rejected），
+        一条错误记录不会阻塞其他记录的写入
+
+        :param rows: 记录列表
+        :return: 因可重试异常未写入的记录列表
+        """
+        batches = deque([rows])
+        while batches:
+            batch = batches.popleft()
+            try:
+                self.sink(batch)
+                self.written += len(batch)
+            except self.retry_errors as err:
+                remaining = batch + [row for rest in batches for row in rest]
+                self.failed += len(remaining)
+                LOGGER.error('%s flush %d rows failed: %s', self.name, len(remaining), err)
+                return remaining
+            except Exception as err:
+                if len(batch) == 1:
+                    self.rejected += 1
+                    LOGGER.error('%s rejected row %r: %s', self.name, batch[0], err)
+                else:
+                    middle = len(batch) // 2
+                    batches.extendleft((batch[middle:], batch[:middle]))
+        return []
+
+    def flush(self):
+        """将缓冲中的记录全部写入，因可重试异常写入失败的记录放回缓冲等待下次写入（超出max_size部分丢弃）"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return
+            rows = self._write(rows)
+            if rows:
+                with self._lock:
+                    self._rows = rows + self._rows
+                    overflow = len(self._rows) - self.max_size
+                    if overflow > 0:
+                        self.dropped += overflow
+                        del self._rows[:overflow]
+
+    def stop(self):
+        """停止后台线程，并写入缓冲中剩余的记录"""
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+        if self.dropped or self.rejected:
+            LOGGER.warning('%s dropped %d rows, rejected %d rows', self.name, self.dropped, self.rejected)
+
+    def stats(self):
+        """写缓冲统计信息
+
+        :return: 包括pending（待写入）、written（已写入）、failed（写入失败记录数）、dropped（已丢弃）
+            和rejected（写入出错被丢弃）记录数的字典
+        """
+        return {'pending': len(self._rows), 'written': self.written, 'failed': self.failed, 'dropped': self.dropped,
+                'rejected': self.rejected}
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from crontab import CronTab
+from cronmon import get_config
+
+
+CFG = get_config()
+
+
+class LRUCache(object):
+    """进程内有界缓存，按LRU淘汰，同时支持TTL过期，并记录命中和未命中次数"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        """
+        :param maxsize: 最大缓存条目数
+        :param ttl: 缓存有效期（秒），小于等于0表示不过期
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """获取缓存值，不存在或已过期则返回default"""
+        with self._lock:
+            try:
+                expire, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expire and expire < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """写入缓存，超出maxsize时淘汰最久未使用的条目"""
+        expire = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            self._data[key] = (expire, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        """使指定键失效"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """缓存统计信息
+
+        :return: 包括size（条目数）、hits（命中次数）和misses（未命中次数）的字典
+        """
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+
+@lru_cache(maxsize=CFG.CRONTAB_CACHE_SIZE)
+def get_crontab(period):
+    """按crontab表达式缓存解析后的CronTab对象（非法表达式抛出的异常不会被缓存）
+
+    :param period: crontab表达式
+    :return: CronTab对象
+    """
+    return CronTab(period)
+
+
+@lru_cache(maxsize=CFG.CRONTAB_CACHE_SIZE)
+def crontab_next(period, timestamp):
+    """计算crontab表达式在指定时间之后下次执行的间隔，同一检查周期内相同表达式只计算一次
+
+    :param period: crontab表达式
+    :param timestamp: 时间戳
+    :return: 距离下次执行的秒数
+    """
+    return get_crontab(period).next(now=datetime.fromtimestamp(timestamp), default_utc=False)
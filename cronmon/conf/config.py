@@ -8,7 +8,12 @@ class Config:
     DB_USER = 'cronmon_user'  # 数据库用户名
     DB_PASSWD = 'cronmon_pwd'  # 数据库密码
     DB_DATABASE = 'cronmon'  # 数据库名
+    DB_POOL = False  # 是否使用数据库连接池（每个请求从连接池获取连接，请求结束后放回，uwsgi gevent模式下需开启gevent-monkey-patch）
+    DB_MAX_CONNECTIONS = 20  # 连接池最大连接数（每个进程）
+    DB_STALE_TIMEOUT = 300  # 连接最长使用时间（秒），超过后关闭重建
+    DB_POOL_TIMEOUT = 10  # 连接池已满时等待空闲连接的最长时间（秒）
     ITEMS_PER_PAGE = 10  # 每页显示记录数
+    TASKLOG_COUNT_LIMIT = 1000  # 任务日志页面统计记录数上限（超过时显示为“1000+”）
     URL_ROOT = 'http://cronmon.yoursite.io/api/monlink/'  # 监控URL公共部分
     VALIDATE_CODE_USE = False  # 登陆时是否开启验证码
     SESSION_COOKIE_SECURE = False  # session cookie是否仅通过HTTPS发送
@@ -22,7 +27,62 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')  # 邮件服务器登录密码
     MAIL_MAX_EMAILS = 5  # 一次连接中发送的最大邮件数
     MAIL_DEFAULT_SENDER = 'CRONMON <sendmail@yoursite.io>'  # 发件人显示名称和地址
-    # 后台循环任务，job1为crontab监控检查任务，job2为空业务检查任务
+    MAIL_CONN_IDLE = 60  # SMTP连接最大空闲时间（秒），超过后重新连接
+    ALERT_DIGEST = False  # 是否开启告警摘要模式（同一收件人的多条任务状态变化告警合并为一封邮件）
+    ALERT_DIGEST_WINDOW = 0  # 告警摘要合并窗口（秒），0表示按每次检查合并
+    ALERT_OUTBOX = False  # 是否开启告警发件箱（检查任务只写入发件箱，由后台任务并发投递）
+    ALERT_OUTBOX_INTERVAL = 10  # 发件箱投递间隔（秒）
+    ALERT_OUTBOX_BATCH = 200  # 每次投递最大邮件数
+    ALERT_OUTBOX_WORKERS = 4  # 并发投递线程数
+    ALERT_OUTBOX_MAX_ATTEMPTS = 8  # 最大投递次数，超过后标记为dead
+    ALERT_OUTBOX_RETRY_BASE = 30  # 投递失败后重试间隔基数（秒），按2的指数增长
+    ALERT_OUTBOX_RETRY_MAX = 3600  # 最大重试间隔（秒）
+    MONLINK_CACHE_SIZE = 100000  # 监控url缓存最大条目数（每个worker进程）
+    MONLINK_CACHE_TTL = 300  # 监控url缓存有效期（秒）
+    MONLINK_BUFFER = False  # 是否开启监控请求日志缓冲写入（每个worker进程在内存中累积后批量写入数据库）
+    MONLINK_BUFFER_ROWS = 500  # 缓冲累积到此条数时写入
+    MONLINK_BUFFER_INTERVAL = 1000  # 缓冲写入间隔（毫秒）
+    MONLINK_BUFFER_MAX = 20000  # 缓冲最大记录数
+    MONLINK_BUFFER_OVERFLOW = 'block'  # 缓冲已满时的处理方式，'block'为在请求中同步写入，'drop'为丢弃
+    MONLINK_FAST_PATH = False  # 是否开启监控url请求WSGI快速通道（不经过flask请求处理流程，响应内容不变）
+    INGEST_HOST = '127.0.0.1'  # 独立监控url请求接收服务（cronmon-ingest）监听地址
+    INGEST_PORT = 5001  # cronmon-ingest监听端口
+    INGEST_BACKLOG = 10240  # cronmon-ingest监听队列长度
+    INGEST_KEEPALIVE_TIMEOUT = 75  # cronmon-ingest keep-alive连接空闲超时时间（秒）
+    INGEST_MAX_BODY = 1024  # cronmon-ingest请求体最大长度（字节），超过时返回400并关闭连接
+    INGEST_DB_THREADS = 4  # cronmon-ingest查询任务和缓冲已满时写入数据库使用的线程数
+    INGEST_REAL_IP_HEADER = ''  # 客户端ip请求头（如nginx转发时设置的'X-Real-IP'），为空时使用连接的对端地址
+    API_LOG_MODE = 'db'  # 接口请求日志记录方式，'db'为数据库，'file'为JSON Lines文件，'off'为不记录（均为后台批量写入）
+    API_LOG_FILE = '/var/log/cronmon_api.jsonl'  # 'file'模式下的日志文件路径
+    API_LOG_BATCH = 200  # 接口请求日志缓冲累积到此条数时写入
+    API_LOG_INTERVAL = 1000  # 接口请求日志缓冲写入间隔（毫秒）
+    API_LOG_MAX = 10000  # 接口请求日志缓冲最大记录数，超过后丢弃新记录
+    API_COUNT_CACHE_TTL = 30  # 接口任务记录数缓存有效期（秒）
+    PERM_CACHE_SIZE = 10000  # 用户业务权限缓存最大条目数（每个进程）
+    PERM_CACHE_TTL = 10  # 用户业务权限缓存有效期（秒），0表示不缓存（只在同一请求内复用）
+    CRONTAB_CACHE_SIZE = 4096  # 已解析crontab表达式缓存最大条目数
+    CHECK_MODE = 'scan'  # 任务检查模式，'scan'为每次检查全部任务，'deadline'为按下次检查时间只检查到期任务
+    DEADLINE_RESYNC = 3600  # 'deadline'模式下从数据库全量重新加载任务的间隔（秒）
+    # 多个节点检查任务（CHECK_SHARDS不为1或开启SCHEDULER_LEASE）时的全量重新加载间隔（秒），
+    # 其他主机web端修改的任务只能通过全量加载同步到本检查进程，最迟在此间隔后生效
+    DEADLINE_RESYNC_MULTI = 60
+    CHECK_WORKERS = 0  # 任务状态并发计算的工作线程数，0为在检查线程中逐个计算
+    CHECK_POOL_CHUNK = 2000  # 并发计算时每批任务数
+    # 任务检查分片数，1为不分片，大于1时本检查进程只检查'id % CHECK_SHARDS == CHECK_SHARD_INDEX'的任务，
+    # 0为自动分片（按CheckerNode中心跳未超时的检查进程数分片，检查进程增减时自动重新分配）
+    CHECK_SHARDS = 1
+    CHECK_SHARD_INDEX = int(os.environ.get('CRONMON_SHARD_INDEX', 0))  # 本检查进程的分片序号（0到CHECK_SHARDS-1）
+    CHECK_NODE_NAME = os.environ.get('CRONMON_NODE_NAME', '')  # 自动分片时的检查进程名称，为空时使用'主机名:进程号'
+    CHECK_NODE_TIMEOUT = 150  # 自动分片时检查进程心跳超时时间（秒），超时的检查进程不再分配任务（各主机需同步时钟）
+    SCHEDULER_LEASE = False  # 是否开启调度主节点选举（多个节点运行cron.py时只有租约持有者运行LEADER_JOBS中的任务）
+    SCHEDULER_LEASE_TTL = 30  # 租约有效期（秒），主节点失效后备用节点最迟在有效期加续约间隔后接管
+    SCHEDULER_LEASE_RENEW = 10  # 续约和抢占租约的间隔（秒），需小于SCHEDULER_LEASE_TTL
+    LEADER_JOBS = ['job1', 'job2', 'job3', 'job4']  # 只在主节点运行的任务id，分片检查模式（CHECK_SHARDS不为1）下自动去掉job1
+    STATS_ROLLUP_INTERVAL = 60  # 统计汇总任务间隔（秒）
+    STATS_ROLLUP_BATCH = 100000  # 统计汇总每批处理的日志记录数（按id区间）
+    STATS_CACHE_TTL = 60  # 首页dashboard数据缓存有效期（秒）
+    TASKLOG_KEEP_DAYS = 31  # 任务日志保留天数，与production/cronmonPartition.sql中taskmonitorlog分区保留天数一致
+    # 后台循环任务，job1为crontab监控检查任务，job2为空业务检查任务，job3为告警发件箱投递任务，job4为统计汇总任务
     JOBS = [
         {
             'id': 'job1',
@@ -35,6 +95,18 @@ class Config:
             'func': 'cronmon.main.taskcyclecheck:emptybusinesscheck',
             'trigger': 'interval',
             'seconds': 3600
+        },
+        {
+            'id': 'job3',
+            'func': 'cronmon.outbox:drain',
+            'trigger': 'interval',
+            'seconds': ALERT_OUTBOX_INTERVAL
+        },
+        {
+            'id': 'job4',
+            'func': 'cronmon.stats:rollup',
+            'trigger': 'interval',
+            'seconds': STATS_ROLLUP_INTERVAL
         }
     ]
 
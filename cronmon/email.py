@@ -1,26 +1,114 @@
 import os
+import smtplib
+import threading
+import time
 from flask_mail import Message
-from cronmon import get_logger
+from cronmon import get_logger, get_config
 from . import mail
 from . import create_app
 
 
 LOGGER = get_logger(__name__)
+CFG = get_config()
+
+# 发送邮件使用的app（scheduler启动时通过init_mail_app设置，未设置时在第一次发送时创建）
+_APP = None
+# 每个线程各自持有的SMTP连接
+_LOCAL = threading.local()
+_STATS_LOCK = threading.Lock()
+# 邮件发送耗时统计，prepare为构造邮件和获取连接耗时，deliver为实际发送耗时（秒）
+MAIL_STATS = {'batches': 0, 'messages': 0, 'connects': 0, 'prepare_time': 0.0, 'deliver_time': 0.0}
+
+
+def init_mail_app(app):
+    """设置发送邮件使用的app
+
+    :param app: 已初始化的app
+    :return: 无
+    """
+    global _APP
+    _APP = app
+
+
+def get_mail_app():
+    """获取发送邮件使用的app，只在第一次调用时创建"""
+    global _APP
+    if _APP is None:
+        _APP = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    return _APP
+
+
+def close_connection():
+    """关闭当前线程的SMTP连接"""
+    conn = getattr(_LOCAL, 'conn', None)
+    _LOCAL.conn = None
+    if conn is not None and conn.host is not None:
+        try:
+            conn.host.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+def get_connection():
+    """获取当前线程的SMTP连接（需要在app context中调用），空闲超过MAIL_CONN_IDLE或NOOP检测失败时重新连接"""
+    conn = getattr(_LOCAL, 'conn', None)
+    if conn is not None and conn.host is not None:
+        stale = time.monotonic() - _LOCAL.last_used > CFG.MAIL_CONN_IDLE
+        if not stale:
+            try:
+                stale = conn.host.noop()[0] != 250
+            except (smtplib.SMTPException, OSError):
+                stale = True
+        if stale:
+            close_connection()
+            conn = None
+
+    if conn is None:
+        conn = mail.connect()
+        conn.__enter__()
+        _LOCAL.conn = conn
+        with _STATS_LOCK:
+            MAIL_STATS['connects'] += 1
+    _LOCAL.last_used = time.monotonic()
+    return conn
 
 
 def send_email(infolist):
-    """发送邮件
+    """发送邮件，复用同一个app和当前线程的SMTP连接
 
     :param infolist: 一个由列表组成的列表，每个子列表包含收件人，正文和主体三部分信息
     :return: 无
     """
-    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
-    app_ctx = app.app_context()
-    app_ctx.push()
-    with mail.connect() as conn:
-        with app.app_context():
-            for info in infolist:
-                msg = Message(subject=info[2], body=info[1], recipients=[info[0]])
+    if not infolist:
+        return
+
+    app = get_mail_app()
+    with app.app_context():
+        start = time.perf_counter()
+        messages = [Message(subject=info[2], body=info[1], recipients=[info[0]]) for info in infolist]
+        conn = get_connection()
+        prepared = time.perf_counter()
+
+        for info, msg in zip(infolist, messages):
+            try:
                 conn.send(msg)
-                msg = 'Send mail to ' + info[0] + ': ' + info[2] + ' --- ' + info[1]
-                LOGGER.warn(msg)
+            except smtplib.SMTPServerDisconnected:
+                # 连接已被服务端关闭，重新连接后重试一次
+                close_connection()
+                conn = get_connection()
+                conn.send(msg)
+            except (smtplib.SMTPException, OSError):
+                close_connection()
+                raise
+            msg = 'Send mail to ' + info[0] + ': ' + info[2] + ' --- ' + info[1]
+            LOGGER.warn(msg)
+        _LOCAL.last_used = time.monotonic()
+        delivered = time.perf_counter()
+
+    with _STATS_LOCK:
+        MAIL_STATS['batches'] += 1
+        MAIL_STATS['messages'] += len(messages)
+        MAIL_STATS['prepare_time'] += prepared - start
+        MAIL_STATS['deliver_time'] += delivered - prepared
+    LOGGER.info('Mail batch: %d messages, prepare %.1f ms, deliver %.1f ms',
+                len(messages), (prepared - start) * 1000, (delivered - prepared) * 1000)
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from cronmon import get_logger, get_config
+from cronmon.api.fastpath import PREFIX, UUID_PATTERN, OK_BODY, OK_HEADERS, BAD_BODY, BAD_HEADERS
+from cronmon.api.ping import TASK_CACHE, PING_WRITER, task_lookup, ping_row
+
+
+LOGGER = get_logger(__name__)
+CFG = get_config()
+MAX_HEADER_SIZE = 8192  # 请求行和请求头最大长度
+NOT_FOUND = ('404 NOT FOUND', [('Content-Type', 'text/plain'), ('Content-Length', '9')], b'Not Found')
+NOT_ALLOWED = ('405 METHOD NOT ALLOWED', [('Content-Type', 'text/plain'), ('Content-Length', '18'),
+                                          ('Allow', 'GET, HEAD')], b'Method Not Allowed')
+OK = ('200 OK', OK_HEADERS, OK_BODY)
+BAD_REQUEST = ('400 BAD REQUEST', BAD_HEADERS, BAD_BODY)
+
+
+def build_response(response, keep_alive, head_only):
+    """生成HTTP响应报文
+
+    :param response: (状态, 响应头列表, 响应内容)
+    :param keep_alive: 是否保持连接
+    :param head_only: 是否为HEAD请求（不返回响应内容）
+    :return: 响应报文
+    """
+    status, headers, body = response
+    lines = ['HTTP/1.1 ' + status] + ['%s: %s' % header for header in headers]
+    lines.append('Connection: ' + ('keep-alive' if keep_alive else 'close'))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (b'' if head_only else body)
+
+
+# 响应报文预先生成，以(响应状态, 是否保持连接, 是否为HEAD请求)为键
+RESPONSES = dict(((response[0], keep_alive, head_only), build_response(response, keep_alive, head_only))
+                 for response in (OK, BAD_REQUEST, NOT_FOUND, NOT_ALLOWED)
+                 for keep_alive in (True, False) for head_only in (True, False))
+
+
+def parse_head(head):
+    """解析请求行和请求头
+
+    :param head: 请求行和请求头（以空行结束）
+    :return: 请求方法、路径（不包括查询参数）、HTTP版本和请求头字典（键为小写）
+    """
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, target.split('?', 1)[0], version, headers
+
+
+class IngestServer(object):
+    """独立的监控url请求接收服务（cronmon-ingest），基于asyncio（需要Python 3.5.2及以上版本）
+
+    只提供'/api/monlink/<uuid>'接口，响应内容与cronmon/api/views.py中monlink接口一致，可在nginx中将此路径转发到本服务。
+    每个连接支持keep-alive和pipelining，任务查询（缓存未命中时）在线程池中执行，同一uuid的并发查询合并为一次，
+    请求记录统一写入PING_WRITER缓冲，由后台线程批量写入数据库。
+    """
+
+    def __init__(self, loop, executor):
+        """
+        :param loop: asyncio事件循环
+        :param executor: 执行数据库查询和缓冲写入的线程池
+        """
+        self.loop = loop
+        self.executor = executor
+        self._writers = set()  # 当前连接
+        self._inflight = {}  # 正在查询的uuid为键，查询future为值
+
+    async def lookup(self, cronuuid):
+        """查询任务（优先读取缓存），同一uuid的并发查询只在线程池中执行一次
+
+        :param cronuuid: 监控url（uuid部分）
+        :return: (任务id, 任务状态)，如果不存在此uuid，则返回None
+        """
+        task = TASK_CACHE.get(cronuuid, False)
+        if task is not False:
+            return task
+        future = self._inflight.get(cronuuid)
+        if future is None:
+            future = self.loop.run_in_executor(self.executor, task_lookup, cronuuid)
+            self._inflight[cronuuid] = future
+            future.add_done_callback(lambda f: self._inflight.pop(cronuuid, None))
+        return await future
+
+    async def ping(self, cronuuid, client_ip, user_agent):
+        """记录一次监控请求，缓冲已满时在线程池中写入后加入缓冲，写入数据库不在事件循环线程中执行
+
+        :return: uuid是否有效（uuid不存在或查询出现异常时返回False，缓冲已满丢弃记录时仍返回True）
+        """
+        if not UUID_PATTERN.match(cronuuid):
+            return False
+        cronuuid = cronuuid.lower()
+        try:
+            task = await self.lookup(cronuuid)
+            if task is None:
+                return False
+        except Exception as err:
+            LOGGER.error('Ingest ping %s failed: %s', cronuuid, err)
+            return False
+
+        row = ping_row(task[0], client_ip, user_agent)
+        try:
+            if not PING_WRITER.add(row, block=False) and PING_WRITER.overflow != 'drop':
+                await self.loop.run_in_executor(self.executor, PING_WRITER.add, row)
+        except Exception as err:
+            LOGGER.error('Ingest ping %s failed: %s', cronuuid, err)
+        return True
+
+    async def respond(self, head, reader, client_ip):
+        """处理一个请求
+
+        :return: 响应报文和是否保持连接
+        """
+        try:
+            method, path, version, headers = parse_head(head)
+        except ValueError:
+            return RESPONSES[(BAD_REQUEST[0], False, False)], False
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        # 不支持分块传输的请求体，响应后关闭连接；普通请求体限制长度和读取时间，读取后丢弃
+        if 'transfer-encoding' in headers:
+            keep_alive = False
+        elif headers.get('content-length', '0') != '0':
+            length = int(headers['content-length'])
+            if not 0 <= length <= CFG.INGEST_MAX_BODY:
+                return RESPONSES[(BAD_REQUEST[0], False, method == 'HEAD')], False
+            await asyncio.wait_for(reader.readexactly(length), CFG.INGEST_KEEPALIVE_TIMEOUT)
+
+        cronuuid = path[len(PREFIX):]
+        if not path.startswith(PREFIX) or not cronuuid or '/' in cronuuid:
+            response = NOT_FOUND
+        elif method not in ('GET', 'HEAD'):
+            response = NOT_ALLOWED
+        else:
+            if CFG.INGEST_REAL_IP_HEADER:
+                client_ip = headers.get(CFG.INGEST_REAL_IP_HEADER.lower(), client_ip)
+            ok = await self.ping(cronuuid, client_ip, headers.get('user-agent', ''))
+            response = OK if ok else BAD_REQUEST
+        return RESPONSES[(response[0], keep_alive, method == 'HEAD')], keep_alive
+
+    async def handle(self, reader, writer):
+        """处理一个连接，按顺序处理连接上的请求，直到客户端关闭连接或空闲超时"""
+        peer = writer.get_extra_info('peername')
+        client_ip = str(peer[0]) if peer else ''
+        self._writers.add(writer)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), CFG.INGEST_KEEPALIVE_TIMEOUT)
+                    data, keep_alive = await self.respond(head, reader, client_ip)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError, ValueError):
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def close_connections(self):
+        """关闭全部连接（服务停止时调用）"""
+        for writer in list(self._writers):
+            writer.close()
+
+
+def main(argv=None):
+    """cronmon-ingest入口"""
+    parser = argparse.ArgumentParser(prog='cronmon-ingest', description='cronmon monitor url ingestion server')
+    parser.add_argument('--host', default=CFG.INGEST_HOST, help='listen address')
+    parser.add_argument('--port', type=int, default=CFG.INGEST_PORT, help='listen port')
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = ThreadPoolExecutor(max_workers=CFG.INGEST_DB_THREADS)
+    ingest = IngestServer(loop, executor)
+    server = loop.run_until_complete(asyncio.start_server(ingest.handle, args.host, args.port,
+                                                          backlog=CFG.INGEST_BACKLOG, limit=MAX_HEADER_SIZE))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    LOGGER.info('cronmon-ingest listening on %s:%d', args.host, args.port)
+
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        ingest.close_connections()
+        loop.run_until_complete(server.wait_closed())
+        executor.shutdown()
+        PING_WRITER.stop()
+        loop.close()
+        LOGGER.info('cronmon-ingest stopped, %s', PING_WRITER.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import threading
+from datetime import datetime
+from peewee import IntegrityError, SQL, fn
+from cronmon import get_logger, get_config
+from cronmon.batchwriter import at_shutdown
+from cronmon.main.shard import node_name
+from cronmon.models import SchedulerLease
+
+
+LOGGER = get_logger(__name__)
+CFG = get_config()
+CHECK_JOB = 'job1'  # crontab监控检查任务id
+
+
+def leader_jobs():
+    """只在主节点运行的任务id列表，分片检查模式（CHECK_SHARDS不为1）下每个节点都需检查本分片的任务，去掉检查任务
+
+    :return: 任务id列表
+    """
+    job_ids = list(CFG.LEADER_JOBS)
+    if CFG.CHECK_SHARDS != 1 and CHECK_JOB in job_ids:
+        LOGGER.warning('Job %s runs on every node in sharded check mode, removed from LEADER_JOBS', CHECK_JOB)
+        job_ids.remove(CHECK_JOB)
+    return job_ids
+
+
+def acquire_lease(name, holder, ttl):
+    """获取或续约租约，租约不存在、已过期或已由holder持有时成功（一条带条件的UPDATE语句，多节点并发时只有一个成功）
+
+    到期时间的计算和比较都使用数据库时钟（NOW()），不受各节点本地时钟偏差影响
+
+    :param name: 租约名称
+    :param holder: 持有者名称
+    :param ttl: 租约有效期（秒）
+    :return: 是否持有租约
+    """
+    expire_time = fn.DATE_ADD(fn.NOW(), SQL('INTERVAL %s SECOND', (ttl,)))
+    updated = SchedulerLease.update(holder=holder, expire_time=expire_time)\
+        .where(SchedulerLease.name == name,
+               (SchedulerLease.holder == holder) | (SchedulerLease.expire_time < fn.NOW()))\
+        .execute()
+    if updated:
+        return True
+    try:
+        SchedulerLease.insert(name=name, holder=holder, expire_time=expire_time).execute()
+        return True
+    except IntegrityError:
+        # 同一秒内续约时到期时间不变，MySQL返回的影响行数为0，此时按租约持有者判断
+        return SchedulerLease.select()\
+            .where(SchedulerLease.name == name, SchedulerLease.holder == holder,
+                   SchedulerLease.expire_time >= fn.NOW())\
+            .exists()
+
+
+def release_lease(name, holder):
+    """释放租约（只释放holder持有的租约），备用节点在下次抢占时即可接管
+
+    :param name: 租约名称
+    :param holder: 持有者名称
+    :return: 无
+    """
+    SchedulerLease.update(expire_time=datetime.min)\
+        .where(SchedulerLease.name == name, SchedulerLease.holder == holder).execute()
+
+
+class LeaderElection(object):
+    """调度主节点选举，后台线程定时续约或抢占租约，只有租约持有者运行指定的调度任务，其他节点上这些任务处于暂停状态"""
+
+    def __init__(self, scheduler, job_ids, name='scheduler'):
+        """
+        :param scheduler: APScheduler实例
+        :param job_ids: 只在主节点运行的任务id列表
+        :param name: 租约名称
+        """
+        self.scheduler = scheduler
+        self.job_ids = list(job_ids)
+        self.name = name
+        self.leader = False
+        self._stopped = threading.Event()
+
+    def start(self):
+        """暂停主节点任务并启动选举线程（需在scheduler.start()之前调用，避免启动时多个节点同时运行）"""
+        self._switch(False)
+        thread = threading.Thread(target=self._run, name='leader-election')
+        thread.daemon = True
+        thread.start()
+        at_shutdown(self.stop)
+
+    def _run(self):
+        """选举循环，数据库异常时按未持有租约处理"""
+        while not self._stopped.is_set():
+            try:
+                leader = acquire_lease(self.name, node_name(), CFG.SCHEDULER_LEASE_TTL)
+            except Exception as err:
+                LOGGER.error('Scheduler lease renew failed: %s', err)
+                leader = False
+            if leader != self.leader:
+                self._switch(leader)
+            self._stopped.wait(CFG.SCHEDULER_LEASE_RENEW)
+
+    def _switch(self, leader):
+        """成为主节点时恢复任务，失去租约时暂停任务"""
+        self.leader = leader
+        for job_id in self.job_ids:
+            if leader:
+                self.scheduler.resume_job(job_id)
+            else:
+                self.scheduler.pause_job(job_id)
+        LOGGER.info('Scheduler lease %s by %s', 'acquired' if leader else 'not held', node_name())
+
+    def stop(self):
+        """停止选举线程并释放租约"""
+        self._stopped.set()
+        if self.leader:
+            try:
+                release_lease(self.name, node_name())
+            except Exception as err:
+                LOGGER.warning('Scheduler lease release failed: %s', err)
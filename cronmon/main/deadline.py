@@ -0,0 +1,143 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+from cronmon import get_logger, get_config
+from cronmon.models import TaskMonitor
+from cronmon.main.shard import shard_conditions
+
+
+LOGGER = get_logger(__name__)
+CFG = get_config()
+
+RESYNC_ALL = 'all'  # 全部任务重新加载的通知消息
+
+
+class DeadlineQueue(object):
+    """按下次检查时间排序的任务最小堆，每次只取出已到期的任务
+
+    处于告警状态或下次检查时间为空的任务，以最小时间入堆，即每次检查都会取出。
+    任务变化时只记录任务id，在下次检查时统一从数据库重新加载。
+    """
+
+    def __init__(self):
+        self._heap = []  # (下次检查时间, 任务id)，任务变化后旧条目不删除，出堆时按_deadlines校验
+        self._deadlines = {}  # 任务id为键，当前有效的下次检查时间为值
+        self._changed = set()
+        self._resync = True
+        self._resync_time = 0
+        self._shard = None  # 本检查进程的任务分片，不分片时为None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def push(self, task_id, deadline):
+        """任务入堆（覆盖之前的下次检查时间）"""
+        deadline = deadline or datetime.min
+        self._deadlines[task_id] = deadline
+        heapq.heappush(self._heap, (deadline, task_id))
+
+    def remove(self, task_id):
+        """任务出堆（堆中的旧条目在出堆时丢弃）"""
+        self._deadlines.pop(task_id, None)
+
+    def touch(self, task_id):
+        """记录任务变化，task_id为RESYNC_ALL时全部重新加载"""
+        with self._lock:
+            if task_id == RESYNC_ALL:
+                self._resync = True
+            else:
+                self._changed.add(int(task_id))
+
+    def set_shard(self, shard):
+        """设置本检查进程的任务分片，分片变化时全部重新加载"""
+        with self._lock:
+            if shard != self._shard:
+                self._shard = shard
+                self._resync = True
+
+    def rebuild(self):
+        """从数据库重新加载全部启用状态的任务（分片模式下只加载本分片的任务）"""
+        query = TaskMonitor.select(TaskMonitor.id, TaskMonitor.next_check_time, TaskMonitor.warning)\
+            .where(TaskMonitor.status == 1, *shard_conditions(self._shard)).tuples()
+        self._heap = []
+        self._deadlines = {}
+        for task_id, next_check_time, warning in query:
+            self.push(task_id, None if warning else next_check_time)
+        self._resync_time = time.time()
+        LOGGER.info('Deadline queue rebuilt: %d tasks', len(self._deadlines))
+
+    def reload(self, task_ids):
+        """从数据库重新加载指定任务，禁用或已删除的任务出堆"""
+        for task_id in task_ids:
+            self.remove(task_id)
+        query = TaskMonitor.select(TaskMonitor.id, TaskMonitor.next_check_time, TaskMonitor.warning)\
+            .where(TaskMonitor.id.in_(list(task_ids)), TaskMonitor.status == 1, *shard_conditions(self._shard))\
+            .tuples()
+        for task_id, next_check_time, warning in query:
+            self.push(task_id, None if warning else next_check_time)
+
+    def pop_due(self, current_datetime):
+        """取出已到期的任务，返回任务id列表
+
+        :param current_datetime: 当前时间
+        :return: 到期任务id列表
+        """
+        with self._lock:
+            resync, self._resync = self._resync, False
+            changed, self._changed = self._changed, set()
+        if resync or time.time() - self._resync_time > resync_interval():
+            self.rebuild()
+        elif changed:
+            self.reload(changed)
+
+        due = []
+        while self._heap and self._heap[0][0] <= current_datetime:
+            deadline, task_id = heapq.heappop(self._heap)
+            if self._deadlines.get(task_id) == deadline:
+                del self._deadlines[task_id]
+                due.append(task_id)
+        return due
+
+    def reschedule(self, tasks, updates):
+        """检查完成后将任务按新的下次检查时间重新入堆
+
+        :param tasks: 已检查的任务字典列表
+        :param updates: 任务id为键，已写入的更新字段字典为值
+        :return: 无
+        """
+        for task in tasks:
+            task = dict(task, **updates.get(task['id'], {}))
+            self.push(task['id'], None if task['warning'] else task['next_check_time'])
+
+
+DEADLINE_QUEUE = DeadlineQueue()
+
+
+def resync_interval():
+    """全量重新加载间隔，多个节点检查任务时使用较短的DEADLINE_RESYNC_MULTI
+
+    :return: 间隔（秒）
+    """
+    if CFG.CHECK_SHARDS != 1 or CFG.SCHEDULER_LEASE:
+        return CFG.DEADLINE_RESYNC_MULTI
+    return CFG.DEADLINE_RESYNC
+
+
+def notify_task_change(task_id=RESYNC_ALL):
+    """通知检查进程任务已变化（新增、修改、禁用或删除），CHECK_MODE为'deadline'时有效
+
+    uwsgi模式下通过mule消息通知运行cron.py的mule进程，否则直接修改本进程的队列。
+    消息只送达本机的一个mule，多个节点检查任务时，其他检查进程在DEADLINE_RESYNC_MULTI定时全量加载时同步任务变化
+
+    :param task_id: 任务id，不传参数表示全部任务
+    :return: 无
+    """
+    if CFG.CHECK_MODE != 'deadline':
+        return
+    try:
+        import uwsgi
+        uwsgi.mule_msg(str(task_id))
+    except Exception:
+        DEADLINE_QUEUE.touch(task_id)
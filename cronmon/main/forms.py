@@ -4,16 +4,17 @@ from wtforms.widgets import HTMLString, html_params
 from wtforms.validators import DataRequired, Length, NumberRange, Email, EqualTo, Regexp, InputRequired
 from wtforms import StringField, SubmitField, BooleanField, SelectField, SelectMultipleField, IntegerField, \
     PasswordField, ValidationError
-from crontab import CronTab
 from flask_login import current_user
-from cronmon.models import Business, TaskMonitor, Notifier, Permission, User
+from cronmon.cache import get_crontab
+from cronmon.models import Business, TaskMonitor, Notifier, User
+from cronmon.perm import SUPERUSER_PERM, get_perm_list, perm_business
 
 
 def perm_check(query_all):
     """根据业务权限调整查询语句"""
-    perm_list = Permission.select().where(Permission.perm_user_id == current_user.id).get().perm_list.split()
-    if not perm_list == ['0']:
-        query = query_all.where(Business.id.in_(perm_list))
+    perm_list = get_perm_list(current_user.id)
+    if not perm_list == SUPERUSER_PERM:
+        query = query_all.where(Business.id.in_(perm_business(current_user.id)))
     else:
         query = query_all
 
@@ -23,7 +24,7 @@ def perm_check(query_all):
 def validate_crontab(form, field):
     """crontab字段格式校验"""
     try:
-        CronTab(field.data).next(default_utc=False)
+        get_crontab(field.data).next(default_utc=False)
     except:
         raise ValidationError('非法的crontab格式')
 
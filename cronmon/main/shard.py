@@ -0,0 +1,78 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from peewee import fn
+from cronmon import get_logger, get_config
+from cronmon.batchwriter import at_shutdown
+from cronmon.models import TaskMonitor, CheckerNode
+
+
+LOGGER = get_logger(__name__)
+CFG = get_config()
+_STATE = {'shard': None, 'registered': False}
+
+
+def node_name():
+    """本检查进程名称（每次调用时获取进程号，避免fork前后进程号不一致）"""
+    return CFG.CHECK_NODE_NAME or '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def leave():
+    """删除本检查进程的心跳记录（进程退出时调用），其他检查进程在下次检查时即重新分片"""
+    try:
+        CheckerNode.delete().where(CheckerNode.name == node_name()).execute()
+    except Exception as err:
+        LOGGER.warning('Checker node leave failed: %s', err)
+
+
+def heartbeat():
+    """记录本检查进程心跳，并清理长时间没有心跳的记录
+
+    :return: 心跳未超时的检查进程名称列表（按名称排序）
+    """
+    now = datetime.now()
+    name = node_name()
+    CheckerNode.insert(name=name, heartbeat=now).on_conflict(update={CheckerNode.heartbeat: now}).execute()
+    if not _STATE['registered']:
+        _STATE['registered'] = True
+        at_shutdown(leave)
+
+    timeout = timedelta(seconds=CFG.CHECK_NODE_TIMEOUT)
+    CheckerNode.delete().where(CheckerNode.heartbeat < now - timeout * 10).execute()
+    query = CheckerNode.select(CheckerNode.name).where(CheckerNode.heartbeat >= now - timeout)\
+        .order_by(CheckerNode.name).tuples()
+    alive = [node for node, in query]
+    if name not in alive:
+        alive = sorted(alive + [name])
+    return alive
+
+
+def current_shard():
+    """获取本检查进程的任务分片，自动分片模式下同时记录心跳
+
+    :return: (分片数, 分片序号)，不分片时返回None
+    """
+    if CFG.CHECK_SHARDS == 1:
+        shard = None
+    elif CFG.CHECK_SHARDS > 1:
+        shard = (CFG.CHECK_SHARDS, CFG.CHECK_SHARD_INDEX)
+    else:
+        alive = heartbeat()
+        shard = (len(alive), alive.index(node_name())) if len(alive) > 1 else None
+
+    if shard != _STATE['shard']:
+        _STATE['shard'] = shard
+        LOGGER.info('Checker shard changed: %s', '%d/%d' % (shard[1], shard[0]) if shard else 'all')
+    return shard
+
+
+def shard_conditions(shard):
+    """任务分片查询条件
+
+    :param shard: current_shard的返回值
+    :return: 查询条件列表，不分片时为空列表
+    """
+    if shard is None:
+        return []
+    count, index = shard
+    return [fn.MOD(TaskMonitor.id, count) == index]
@@ -1,102 +1,240 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
-from crontab import CronTab
-from peewee import fn
-from cronmon.models import Business, TaskMonitor, TaskMonitorLog, BusinessNotifier, Notifier, User, Permission
-from cronmon.email import send_email
-from cronmon import get_logger
+from peewee import fn, Case, JOIN
+from cronmon.models import Business, TaskMonitor, BusinessNotifier, Notifier, User, UserBusiness
+from cronmon.cache import crontab_next
+from cronmon.outbox import send_alerts
+from cronmon.main.deadline import DEADLINE_QUEUE, RESYNC_ALL
+from cronmon.main.shard import current_shard, shard_conditions
+from cronmon import get_logger, get_config
 
 
 LOGGER = get_logger(__name__)
+CFG = get_config()
+CHUNK_SIZE = 1000  # 批量查询和批量更新时每批任务数
+POOL = None  # 任务状态并发计算的线程池（CHECK_WORKERS大于0时创建，长期存在）
 
 
-def taskcyclecheck():
-    """根据任务上次检查时间、任务下次检查时间和当前时间，当任务告警状态发生变化时，通过邮件通知到对应业务的联系人"""
+def load_tasks(*conditions):
+    """一次关联查询获取启用状态的任务、所属业务以及业务下生效的通知人
 
-    # 获取当前时间（二种格式）
-    current_timestamp = int(time.time())
-    current_datetime = datetime.fromtimestamp(current_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-    # 获取状态为启用的业务列表
-    query1 = TaskMonitor.select().where(TaskMonitor.status == 1)
+    :param conditions: 额外的查询条件
+    :return: 任务字典列表，每个字典的emails键为生效通知人邮件地址列表
+    """
+    query = TaskMonitor\
+        .select(TaskMonitor.id, TaskMonitor.name, TaskMonitor.period, TaskMonitor.grace_time,
+                TaskMonitor.last_check_time, TaskMonitor.next_check_time, TaskMonitor.warning,
+                TaskMonitor.last_ping_time, TaskMonitor.create_datetime, Business.business_name,
+                Notifier.notify_email)\
+        .join(Business)\
+        .join(BusinessNotifier, JOIN.LEFT_OUTER, on=(BusinessNotifier.business == Business.id))\
+        .join(Notifier, JOIN.LEFT_OUTER, on=((BusinessNotifier.notifier == Notifier.id) & (Notifier.status == True)))\
+        .where(TaskMonitor.status == 1, *conditions)\
+        .order_by(TaskMonitor.id)\
+        .dicts()
+
+    # 每个任务按通知人数量返回多行，按任务id合并
+    tasks = OrderedDict()
+    for row in query:
+        email = row.pop('notify_email')
+        task = tasks.setdefault(row['id'], dict(row, emails=[]))
+        if email:
+            task['emails'].append(email)
+    return list(tasks.values())
+
+
+def latest_pings(tasks):
+    """获取任务的最新请求时间，直接使用任务的last_ping_time，不查询日志表
+
+    已有系统升级时由migrate.py upgrade回填last_ping_time，之后last_ping_time为空表示任务从未有过请求
+
+    :param tasks: 任务字典列表
+    :return: 任务id为键，最新请求时间为值的字典（没有请求的任务不包括在内）
+    """
+    return dict((task['id'], task['last_ping_time']) for task in tasks if task['last_ping_time'])
+
+
+def check_task(task, current_timestamp, latest_ping):
+    """根据任务上次检查时间、下次检查时间、当前时间以及最新请求时间计算任务状态
+
+    :param task: 任务字典
+    :param current_timestamp: 当前时间戳
+    :param latest_ping: 任务最新请求时间，没有请求则为None
+    :return: 需要更新的字段字典（无需更新则为空字典）和告警主题（告警状态未变化则为None）
+    """
+    current_datetime = datetime.fromtimestamp(current_timestamp)
+    grace_time = int(task['grace_time']) * 60
+    last_check_time = task['last_check_time']
+    next_check_time = task['next_check_time']
+    warning = task['warning']
+    update = {}
+    subject = None
+
+    # 任务上次检查时间（last_check_time）初始化（如果为空值，则以任务创建时间为值）
+    if not last_check_time:
+        last_check_time = task['create_datetime']
+        update['last_check_time'] = last_check_time
+
+    # 任务下次检查时间（next_check_time init）初始化（如果为空值，则以计算出的next_check_datetime为值）
+    add = int(crontab_next(task['period'], current_timestamp))
+    next_check_datetime = datetime.fromtimestamp(current_timestamp + add + grace_time)
+    if not next_check_time:
+        next_check_time = next_check_datetime
+        update['next_check_time'] = next_check_time
+
+    # 如果当前时间大于下次检查时间且不处于告警状态或者处于告警状态
+    if (current_datetime >= next_check_time and not warning) or warning:
+        # 如果有大于上次检查时间的请求记录，则将其作为新的last_check_time，之前warning值为True时生成恢复通知
+        if latest_ping and latest_ping > last_check_time:
+            if warning:
+                subject = 'Status is Up'
+            update.update(warning=False, last_check_time=latest_ping, next_check_time=next_check_datetime)
+            msg = 'TASK ' + task['name'] + ' : OK'
+            LOGGER.warn(msg)
+        # 如果没有大于上次检查时间的请求记录且之前warning值为False，则将其更改为True，同时生成告警通知
+        else:
+            if not warning:
+                subject = 'Status is Down'
+                update['warning'] = True
+            msg = 'TASK ' + task['name'] + ' : NOT OK'
+            LOGGER.error(msg)
 
-    # 列表生成
+    return update, subject
+
+
+def evaluate(tasks, current_timestamp, pings):
+    """逐个计算任务状态，单个任务异常（如非法的crontab表达式）只记录日志，不影响其他任务
+
+    :param tasks: 任务字典列表
+    :param current_timestamp: 当前时间戳
+    :param pings: 任务id为键，最新请求时间为值的字典
+    :return: 任务id为键、需要更新的字段字典为值的字典，以及告警信息列表
+    """
+    updates = {}
+    infolist = []
+    for task in tasks:
+        try:
+            update, subject = check_task(task, current_timestamp, pings.get(task['id']))
+        except Exception as err:
+            LOGGER.error('TASK %s : check failed: %s', task['name'], err)
+            continue
+        if update:
+            updates[task['id']] = update
+        if subject:
+            for email in task['emails']:
+                infolist.append([email, task['name'], subject])
+    return updates, infolist
+
+
+def evaluate_all(tasks, current_timestamp, pings):
+    """计算任务状态，CHECK_WORKERS大于0时按CHECK_POOL_CHUNK分批在线程池中并发计算，结果按任务顺序合并
+
+    不使用进程池：检查进程中已运行调度、缓冲写入和选举等线程，fork子进程可能死锁
+
+    :param tasks: 任务字典列表
+    :param current_timestamp: 当前时间戳
+    :param pings: 任务id为键，最新请求时间为值的字典
+    :return: 同evaluate
+    """
+    chunk_size = CFG.CHECK_POOL_CHUNK
+    if CFG.CHECK_WORKERS <= 0 or len(tasks) <= chunk_size:
+        return evaluate(tasks, current_timestamp, pings)
+
+    global POOL
+    if POOL is None:
+        POOL = ThreadPoolExecutor(max_workers=CFG.CHECK_WORKERS)
+    futures = []
+    for i in range(0, len(tasks), chunk_size):
+        chunk = tasks[i:i + chunk_size]
+        chunk_pings = dict((task['id'], pings[task['id']]) for task in chunk if task['id'] in pings)
+        futures.append(POOL.submit(evaluate, chunk, current_timestamp, chunk_pings))
+
+    updates = {}
     infolist = []
+    for future in futures:
+        chunk_updates, chunk_infolist = future.result()
+        updates.update(chunk_updates)
+        infolist.extend(chunk_infolist)
+    return updates, infolist
+
+
+def apply_updates(updates):
+    """批量写入任务状态变化，每批任务一条UPDATE语句（各字段通过CASE按任务id取值）
 
-    for obj in query1:
-        id = obj.id
-        period = obj.period
-        grace_time = int(obj.grace_time) * 60
-        last_check_time = obj.last_check_time
-        next_check_time = obj.next_check_time
-        create_datetime = obj.create_datetime
-        warning = obj.warning
-
-        # 任务上次检查时间（last_check_time）初始化（如果为空值，则以任务创建时间为值）
-        if not last_check_time:
-            query0 = TaskMonitor.update(last_check_time=create_datetime).where(TaskMonitor.id == id)
-            query0.execute()
-
-        # 任务下次检查时间（next_check_time init）初始化（如果为空值，则以计算出的next_check_datetime为值）
-        entry = CronTab(period)
-        add = int(entry.next(default_utc=False))
-        next_check_timestamp = current_timestamp + add + grace_time
-        next_check_datetime = datetime.fromtimestamp(next_check_timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        if not next_check_time:
-            query1 = TaskMonitor.update(next_check_time=next_check_datetime).where(TaskMonitor.id == id)
-            query1.execute()
-
-        # 获取目前last_check_time值和next_check_time值
-        last_check_datetime2 = TaskMonitor.select().where(TaskMonitor.id == id).get().last_check_time
-        next_check_datetime2 = TaskMonitor.select().where(TaskMonitor.id == id).get().next_check_time
-
-        # 获取通知人列表
-        query3 = TaskMonitor.select().where(TaskMonitor.id == id).get().business.business_name
-        query4 = BusinessNotifier.select().join(Business).\
-            switch(BusinessNotifier).join(Notifier).where(Business.business_name == query3)
-
-        # 如果当前时间大于下次检查时间且不处于告警状态或者处于告警状态
-        if (str(current_datetime) >= str(next_check_datetime2) and not warning) or warning:
-            try:
-                # 查找TaskMonitorLog的记录，如果有大于上次检查时间的记录存在，则将其赋值给last_check_time_new
-                last_check_time_new = TaskMonitorLog.select()\
-                    .where(TaskMonitorLog.taskmon_id == id, TaskMonitorLog.create_datetime > last_check_datetime2)\
-                    .order_by(TaskMonitorLog.id.desc()).get().create_datetime
-                # 如果之前warning值为True，则将其更改为False，生成邮件相关信息，同时写入数据库和日志
-                if warning:
-                    for item in query4:
-                        sublist = []
-                        if item.notifier.status:
-                            subject = 'Status is Up'
-                            sublist.append(item.notifier.notify_email)
-                            sublist.append(obj.name)
-                            sublist.append(subject)
-                            infolist.append(sublist)
-                warning = False
-                query2 = TaskMonitor\
-                    .update(warning=warning, last_check_time=last_check_time_new, next_check_time=next_check_datetime)\
-                    .where(TaskMonitor.id == id)
-                query2.execute()
-                msg = 'TASK ' + obj.name + ' : OK'
-                LOGGER.warn(msg)
-            except:
-                # 如果TaskMonitorLog的记录没有大于上次检查时间的记录存在且之前warning值为False，则将其更改为True，生成邮件相关信息，
-                # 同时写入数据库和日志
-                if not warning:
-                    for item in query4:
-                        sublist = []
-                        if item.notifier.status:
-                            subject = 'Status is Down'
-                            sublist.append(item.notifier.notify_email)
-                            sublist.append(obj.name)
-                            sublist.append(subject)
-                            infolist.append(sublist)
-                warning = True
-                query2 = TaskMonitor.update(warning=warning).where(TaskMonitor.id == id)
-                query2.execute()
-                msg = 'TASK ' + obj.name + ' : NOT OK'
-                LOGGER.error(msg)
+    :param updates: 任务id为键，需要更新的字段字典为值
+    :return: 无
+    """
+    ids = list(updates)
+    for i in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[i:i + CHUNK_SIZE]
+        fields = {}
+        for task_id in chunk:
+            for name, value in updates[task_id].items():
+                fields.setdefault(name, []).append((task_id, value))
+        values = {}
+        for name, cases in fields.items():
+            field = getattr(TaskMonitor, name)
+            values[field] = Case(TaskMonitor.id, cases, field)
+        TaskMonitor.update(values).where(TaskMonitor.id.in_(chunk)).execute()
+
+
+def run_checks(tasks, current_timestamp):
+    """检查任务列表，批量写入状态变化，并通过邮件通知到对应业务的联系人
+
+    :param tasks: 任务字典列表
+    :param current_timestamp: 当前时间戳
+    :return: 任务id为键，已写入的更新字段字典为值
+    """
+    current_datetime = datetime.fromtimestamp(current_timestamp)
+
+    # 获取需要检查的任务（到达下次检查时间或处于告警状态）的最新请求时间
+    due = [task for task in tasks
+           if task['warning'] or not task['next_check_time'] or current_datetime >= task['next_check_time']]
+    pings = latest_pings(due)
+
+    # 计算任务状态并生成告警列表
+    updates, infolist = evaluate_all(tasks, current_timestamp, pings)
+
+    # 批量写入状态变化
+    apply_updates(updates)
     # 发送邮件
-    send_email(infolist)
+    send_alerts(infolist, digest_mode=True)
+
+    return updates
+
+
+def taskcyclecheck():
+    """根据任务上次检查时间、任务下次检查时间和当前时间，当任务告警状态发生变化时，通过邮件通知到对应业务的联系人
+
+    CHECK_MODE为'scan'时每次检查全部启用状态的任务，为'deadline'时只检查下次检查时间已到期的任务，
+    CHECK_SHARDS不为1时只检查本检查进程所属分片的任务
+    """
+
+    # 获取当前时间和本检查进程的任务分片
+    current_timestamp = int(time.time())
+    shard = current_shard()
+
+    if CFG.CHECK_MODE != 'deadline':
+        run_checks(load_tasks(*shard_conditions(shard)), current_timestamp)
+        return
+
+    DEADLINE_QUEUE.set_shard(shard)
+
+    due = DEADLINE_QUEUE.pop_due(datetime.fromtimestamp(current_timestamp))
+    if not due:
+        # 没有到期任务时仍需检查摘要模式下等待合并的告警是否到期
+        send_alerts([], digest_mode=True)
+        return
+    try:
+        tasks = load_tasks(TaskMonitor.id.in_(due))
+        updates = run_checks(tasks, current_timestamp)
+    except:
+        # 已出堆的任务需要重新加载
+        DEADLINE_QUEUE.touch(RESYNC_ALL)
+        raise
+    DEADLINE_QUEUE.reschedule(tasks, updates)
 
 
 def emptybusinesscheck():
@@ -104,63 +242,33 @@ def emptybusinesscheck():
 
     # 获取空联系人业务信息，如果结果为空，则退出后续检查
     subq = BusinessNotifier.select().where(BusinessNotifier.business_id == Business.id)
-    query1 = Business.select().where((~fn.EXISTS(subq)) & (Business.status == True))
-    if not query1:
+    query1 = Business.select(Business.id, Business.business_name)\
+        .where((~fn.EXISTS(subq)) & (Business.status == True)).order_by(Business.id).tuples()
+    empty_business = list(query1)
+    if not empty_business:
         return
 
     # 获取管理员列表
-    query2 = User.select().where((User.admin == True) & (User.status == True))
+    query2 = User.select(User.email).where((User.admin == True) & (User.status == True)).tuples()
 
     # 列表生成（系统管理员）
-    # stridlist用作和perm_list进行交叉比对
-    stridlist = []
-    strlist = []
-    infolist = []
-
     subject = 'Empty Business - SystemAdmin'
-
-    for i in query1:
-        biz = str(i.id) + ' : ' + i.business_name
-        strlist.append(biz)
-        bizid = str(i.id)
-        stridlist.append(bizid)
-    mailstring = "\n".join(strlist)
-
-    for item in query2:
-        subinfolist = []
-        notifier = item.email
-        subinfolist.append(notifier)
-        subinfolist.append(mailstring)
-        subinfolist.append(subject)
-        infolist.append(subinfolist)
+    mailstring = "\n".join(str(bid) + ' : ' + business_name for bid, business_name in empty_business)
+    infolist = [[email, mailstring, subject] for email, in query2]
 
     # 发送告警信息给系统管理员
-    send_email(infolist)
-
-    # 列表生成（业务管理员）
-    strlist = []
-    infolist = []
+    send_alerts(infolist)
 
+    # 列表生成（业务管理员），一次关联查询获取每个业务管理员有权限的空联系人业务（按用户排序后分组）
     subject = 'Empty Business - BizAdmin'
-
-    user_perm_list = Permission.select().join(User)\
-        .where((Permission.perm_list != '0') & (Permission.perm_list != '') & (User.status == 1))
-    for item in user_perm_list:
-        user_perm_list_item = item.perm_list.split()
-        # perm_list和无联系人业务id列表进行交叉比对
-        business_intersection = [x for x in user_perm_list_item if x in set(stridlist)]
-        if business_intersection:
-            subinfolist = []
-            notifier = item.perm_user.email
-            subinfolist.append(notifier)
-            # 根据id获取业务名称作为邮件正文
-            for perm_item in business_intersection:
-                biz = Business.select().where(Business.id == perm_item).get().business_name
-                strlist.append(biz)
-            mailstring = "\n".join(strlist)
-            subinfolist.append(mailstring)
-            subinfolist.append(subject)
-            infolist.append(subinfolist)
+    query3 = UserBusiness.select(User.email, Business.business_name)\
+        .join(User).switch(UserBusiness).join(Business)\
+        .where((~fn.EXISTS(subq)) & (Business.status == True) & (User.status == True))\
+        .order_by(User.id, Business.id).tuples()
+    user_business = OrderedDict()
+    for email, business_name in query3:
+        user_business.setdefault(email, []).append(business_name)
+    infolist = [[email, "\n".join(business_names), subject] for email, business_names in user_business.items()]
 
     # 发送告警信息给业务管理员
-    send_email(infolist)
+    send_alerts(infolist)
@@ -6,8 +6,15 @@ from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash
 from cronmon import get_logger, get_config
 from cronmon import utils
-from cronmon.utils import admin_required, list_gen
-from cronmon.models import DB, User, Permission, Notifier, Business, BusinessNotifier, TaskMonitor, TaskMonitorLog
+from cronmon.utils import admin_required
+from cronmon.api.ping import task_invalidate
+from cronmon.main.deadline import notify_task_change
+from cronmon.serializers import BUSINESS_ITEM, NOTIFIER_ITEM, BUSINESS_NOTIFIER_ITEM, TASK_ITEM, TASKLOG_ITEM, \
+    PERMISSION_ITEM
+from cronmon.perm import SUPERUSER_PERM, get_perm_list, perm_invalidate, perm_business, set_user_business
+from cronmon.stats import DASHBOARD_CACHE, api_request_months
+from cronmon.models import User, Permission, Notifier, Business, BusinessNotifier, TaskMonitor, TaskMonitorLog, \
+    TaskLogDailyStats
 from cronmon.main.forms import BusinessForm, BusinessSearchForm, NotifierForm, NotifierSearchForm, \
     BusinessNotifierForm, BusinessNotifierFormNew, BusinessNotifierSearchForm, TaskForm, TaskFormNew, TaskSearchForm, \
     PermissionForm, PermissionSearchForm, PermissionBizForm, ResetPasswordForm, ChangePasswordForm
@@ -59,32 +66,54 @@ def data_count(db_model, biz_perm):
     """
     day30 = datetime.now() - timedelta(days=30)
 
+    # 任务日志记录数从按天汇总表获取（由统计汇总任务增量维护），不扫描日志表
+    if db_model == TaskMonitorLog:
+        return tasklog_count(biz_perm, day30)
+
     total_query = db_model.select()
     total_query_before30 = db_model.select().where(db_model.create_datetime < day30)
 
-    if biz_perm != ['0']:
+    if biz_perm != SUPERUSER_PERM:
+        perm_filter = Business.id.in_(perm_business(current_user.id))
         if db_model == Business:
-            total_query = total_query.where(Business.id.in_(biz_perm))
-            total_query_before30 = total_query_before30.where(Business.id.in_(biz_perm))
-        elif db_model == TaskMonitorLog:
-            total_query = total_query.join(TaskMonitor, on=(TaskMonitorLog.taskmon_id == TaskMonitor.id))\
-                .join(Business, on=(TaskMonitor.business == Business.id)).where(Business.id.in_(biz_perm))
-            total_query_before30 = total_query_before30\
-                .join(TaskMonitor, on=(TaskMonitorLog.taskmon_id == TaskMonitor.id))\
-                .join(Business, on=(TaskMonitor.business == Business.id)).where(Business.id.in_(biz_perm))
+            total_query = total_query.where(perm_filter)
+            total_query_before30 = total_query_before30.where(perm_filter)
         else:
-            total_query = total_query.join(Business).where(Business.id.in_(biz_perm))
-            total_query_before30 = total_query_before30.join(Business).where(Business.id.in_(biz_perm))
+            total_query = total_query.join(Business).where(perm_filter)
+            total_query_before30 = total_query_before30.join(Business).where(perm_filter)
 
     total_count = total_query.count()
     total_count_before30 = total_query_before30.count()
 
+    return total_count, total_count_before30, diff_rate(total_count, total_count_before30)
+
+
+def diff_rate(total_count, total_count_before30):
+    """计算环比，如果30天前记录数为0，则为inf（无限）"""
     if total_count_before30 == 0:
-        total_count_diff_rate = float("inf")
-    else:
-        total_count_diff_rate = abs(round(100*(total_count-total_count_before30)/total_count_before30, 2))
+        return float("inf")
+    return abs(round(100*(total_count-total_count_before30)/total_count_before30, 2))
+
+
+def tasklog_count(biz_perm, day30):
+    """首页dashboard任务日志记录数，从TaskLogDailyStats按天汇总表获取，只统计日志保留期内（TASKLOG_KEEP_DAYS）的记录
 
-    return total_count, total_count_before30, total_count_diff_rate
+    :param biz_perm: 用户业务权限
+    :param day30: 30天前的时间
+    :return: 同data_count
+    """
+    keep_day = (datetime.now() - timedelta(days=CFG.TASKLOG_KEEP_DAYS)).date()
+    total_query = TaskLogDailyStats.select(peewee.fn.SUM(TaskLogDailyStats.count))\
+        .where(TaskLogDailyStats.day >= keep_day)
+    if biz_perm != SUPERUSER_PERM:
+        total_query = total_query.join(TaskMonitor, on=(TaskLogDailyStats.taskmon_id == TaskMonitor.id))\
+            .where(TaskMonitor.business.in_(perm_business(current_user.id)))
+    total_query_before30 = total_query.where(TaskLogDailyStats.day < day30.date())
+
+    total_count = int(total_query.scalar() or 0)
+    total_count_before30 = int(total_query_before30.scalar() or 0)
+
+    return total_count, total_count_before30, diff_rate(total_count, total_count_before30)
 
 
 def get_parm():
@@ -99,7 +128,7 @@ def get_parm():
     length = int(request.values.get('length')) if request.values.get('length') else CFG.ITEMS_PER_PAGE
     search_content = '' if request.values.get('search_content') is None else request.values.get('search_content')
     search_by = '' if request.values.get('search_by') is None else request.values.get('search_by')
-    biz_perm = Permission.select().where(Permission.perm_user == current_user.id).get().perm_list.split()
+    biz_perm = get_perm_list(current_user.id)
 
     return action, id, bid, page, length, search_content, search_by, biz_perm
 
@@ -148,11 +177,11 @@ def query_limit(query_all, perm, biz_perm, page, length):
     :return: 调整后的查询语句
     """
 
-    # 如果不进行权限检查或用户为超级管理员（perm_list为‘0’）则不调整查询语句，否则则根据perm_list的业务id进行过滤
-    if not perm or biz_perm == ['0']:
+    # 如果不进行权限检查或用户为超级管理员（perm_list为‘0’）则不调整查询语句，否则则根据UserBusiness中用户的业务进行过滤
+    if not perm or biz_perm == SUPERUSER_PERM:
         query = query_all
     else:
-        query = query_all.where(Business.id.in_(biz_perm))
+        query = query_all.where(Business.id.in_(perm_business(current_user.id)))
 
     total_count = query.count()
 
@@ -172,11 +201,21 @@ def perm_check(action, *pospara):
     if action == 'del':
         id, bid, biz_perm, db_model = pospara
         # 如果请求为'POST'方法，id存在且bid在perm_list中或用户为超级管理员（perm_list为‘0’），则进行删除操作，否则提示无权限
-        if request.method == 'POST' and id and (bid in biz_perm or biz_perm == ['0']):
+        if request.method == 'POST' and id and (bid in biz_perm or biz_perm == SUPERUSER_PERM):
             try:
-                db_model.get(db_model.id == id).delete_instance(recursive=True)
+                model = db_model.get(db_model.id == id)
+                model.delete_instance(recursive=True)
                 if db_model == TaskMonitor:
                     TaskMonitorLog.delete().where(TaskMonitorLog.taskmon_id == id).execute()
+                    TaskLogDailyStats.delete().where(TaskLogDailyStats.taskmon_id == id).execute()
+                    task_invalidate(model.url)
+                    notify_task_change(model.id)
+                # 删除业务时会级联删除其下的监控任务，因此清空全部监控url缓存
+                if db_model == Business:
+                    task_invalidate()
+                    notify_task_change()
+                if db_model == User:
+                    perm_invalidate(model.id)
                 flash('删除成功')
             except:
                 flash('删除失败')
@@ -217,16 +256,19 @@ def form_edit(db_model, form, template, form2=False):
         # 如果是指定model，则记录操作前对应字段值
         if db_model == Business or db_model == TaskMonitor:
             try:
-                status_old = db_model.select().where(db_model.id == id).get().status
+                model_old = db_model.select().where(db_model.id == id).get()
             except:
                 abort(500)
+            status_old = model_old.status
+            if db_model == TaskMonitor:
+                url_old = model_old.url
         if db_model == User:
             try:
                 admin_old = db_model.select().where(db_model.id == id).get().admin
             except:
                 abort(500)
         # 权限检查
-        if not (bid in perm_list or perm_list == ['0']):
+        if not (bid in perm_list or perm_list == SUPERUSER_PERM):
             abort(403)
         # 模型转表单
         model = db_model.get(db_model.id == id)
@@ -255,11 +297,16 @@ def form_edit(db_model, form, template, form2=False):
                         if status_old != status_new and status_new is False:
                             toupdate = (TaskMonitor.update({TaskMonitor.status: False}).where(TaskMonitor.business == id))
                             toupdate.execute()
+                            task_invalidate()
+                            notify_task_change()
                     # 如果监控任务状态从启用变为禁用，则对应的告警状态会被重置
                     if db_model == TaskMonitor:
                         if status_old != status_new and status_new is False:
                             toupdate = (TaskMonitor.update({TaskMonitor.warning: False}).where(TaskMonitor.id == id))
                             toupdate.execute()
+                        # 监控任务修改后，使修改前后监控url的缓存失效
+                        task_invalidate(url_old, model.url)
+                        notify_task_change(model.id)
                     # 如果修改用户角色，则进行关联表相关操作
                     # 如果从业务管理员到系统管理员，则将perm_list修改为0
                     if db_model == User and admin_old != admin_new:
@@ -270,6 +317,7 @@ def form_edit(db_model, form, template, form2=False):
                         else:
                             toupdate = (Permission.update({Permission.perm_list: ''}).where(Permission.perm_user == id))
                             toupdate.execute()
+                        set_user_business(id, [])
                     flash('修改成功')
                     return redirect(url_for(redirect_path_edit))
                 else:
@@ -295,6 +343,10 @@ def form_edit(db_model, form, template, form2=False):
                     if form.admin.data:
                         toadd.perm_list = '0'
                     toadd.save()
+                # 如果为监控任务model，则使新监控url可能存在的负缓存失效
+                if db_model == TaskMonitor:
+                    task_invalidate(model.url)
+                    notify_task_change(model.id)
                 flash('保存成功')
                 return redirect(url_for(redirect_path_add))
             else:
@@ -315,7 +367,21 @@ def index_call(template):
     # 获取请求参数和用户权限
     action, id, bid, page, length, search_content, search_by, perm_list = get_parm()
 
-    # 模版字典生成
+    # 模版字典按用户业务权限缓存STATS_CACHE_TTL秒
+    dict = DASHBOARD_CACHE.get(perm_list)
+    if dict is None:
+        dict = index_data(perm_list)
+        DASHBOARD_CACHE.set(perm_list, dict)
+
+    return render_template(template, form=dict, current_user=current_user, current_time=datetime.utcnow())
+
+
+def index_data(perm_list):
+    """首页dashboard数据生成
+
+    :param perm_list: 用户业务权限
+    :return: 模版字典
+    """
 
     count_business = data_count(Business, perm_list)
     count_businessnotifier = data_count(BusinessNotifier, perm_list)
@@ -335,46 +401,14 @@ def index_call(template):
 
     list_dt.reverse()  # 使列表数据从倒序变为顺序
 
-    # API请求列表生成（图表Y轴数据）
-
-    # SQL查询语句和参数
-    query = """
-    select date_format(create_datetime, %s) month,count(id)
-    from apirequestlog
-    where date_format(create_datetime, %s) > date_format(date_sub(curdate(), interval 12 month), %s)
-    and url like %s group by month
-    """
-
-    parm_tasks_all = ('%Y%m', '%Y%m', '%Y%m', '%tasks/all%')  # tasks/all API请求
-    parm_tasks = ('%Y%m', '%Y%m', '%Y%m', '%tasks?%')  # tasks API请求
-
-    # 根据SQL查询结果生成字典，年份日期为键，count结果为值
-    dict_request_tasks_all = {}
-    for i in DB.execute_sql(query, parm_tasks_all):
-        dict_request_tasks_all[i[0]] = i[1]
-
-    dict_request_tasks = {}
-    for i in DB.execute_sql(query, parm_tasks):
-        dict_request_tasks[i[0]] = i[1]
-
-    # 根据年份日期列表和SQL查询结果字典生成最终API请求数据列表
-    list_request_tasks_all = []
-    list_request_tasks = []
-    for i in list_dt:  # 如果年份日期（str(i)）在查询结果字典中有值，则在最终列表中使用此值，否则则赋值为0
-        if str(i) in dict_request_tasks_all:
-            list_request_tasks_all.append(dict_request_tasks_all[str(i)])
-        else:
-            list_request_tasks_all.append(0)
-        if str(i) in dict_request_tasks:
-            list_request_tasks.append(dict_request_tasks[str(i)])
-        else:
-            list_request_tasks.append(0)
+    # API请求列表生成（图表Y轴数据），从ApiRequestStats按月汇总表获取
+    list_request_tasks_all, list_request_tasks = api_request_months(list_dt)
 
     dict = {'business': count_business, 'businessnotifier': count_businessnotifier, 'taskmonitor': count_taskmonitor,
             'taskmonitorlog': count_taskmonitorlog, 'list_dt': list_dt,
             'list_request_tasks_all': list_request_tasks_all, 'list_request_tasks': list_request_tasks}
 
-    return render_template(template, form=dict, current_user=current_user, current_time=datetime.utcnow())
+    return dict
 
 
 def business_list(db_model, form, template):
@@ -403,8 +437,7 @@ def business_list(db_model, form, template):
 
     # 模版字典生成（form2为查询表单）
     query, total_count = query_limit(eval(query_all), True, perm_list, page, length)
-    item = "{'business_name': obj.business_name, 'id': obj.id, 'status': obj.status}"
-    dict = {'content': list_gen(query, item), 'total_count': total_count,
+    dict = {'content': BUSINESS_ITEM(query), 'total_count': total_count,
             'search_by': search_by, 'search_content': search_content,
             'total_page': math.ceil(total_count / length), 'page': page, 'length': length}
 
@@ -437,9 +470,7 @@ def notify_list(db_model, form, template):
 
     # 模版字典生成（form2为查询表单）
     query, total_count = query_limit(eval(query_all), False, perm_list, page, length)
-    item = "{'id': obj.id, 'notify_name': obj.notify_name, 'notify_email': obj.notify_email, " \
-           "'notify_tel': obj.notify_tel, 'status': obj.status}"
-    dict = {'content': list_gen(query, item), 'total_count': total_count,
+    dict = {'content': NOTIFIER_ITEM(query), 'total_count': total_count,
             'search_by': search_by, 'search_content': search_content,
             'total_page': math.ceil(total_count / length), 'page': page, 'length': length}
 
@@ -477,9 +508,7 @@ def business_notifier_list(db_model, db_model2, form, template):
 
     # 模版字典生成（form2为查询表单）
     query, total_count = query_limit(eval(query_all), True, perm_list, page, length)
-    item = "{'business_name': obj.business.business_name, 'id': obj.id, " \
-           "'notify_name': obj.notifier.notify_name, 'bid': obj.business.id}"
-    dict = {'content': list_gen(query, item), 'total_count': total_count,
+    dict = {'content': BUSINESS_NOTIFIER_ITEM(query), 'total_count': total_count,
             'search_by': search_by, 'search_content': search_content,
             'total_page': math.ceil(total_count / length), 'page': page, 'length': length}
 
@@ -519,36 +548,87 @@ def task_list(db_model, db_model2, form, template):
 
     # 模版字典生成（form2为查询表单）
     query, total_count = query_limit(eval(query_all), True, perm_list, page, length)
-    item = "{'warning': obj.warning, 'name': obj.name, 'id': obj.id, 'url': obj.url, 'period': obj.period," \
-           "'grace_time': obj.grace_time,'status': obj.status, " \
-           "'business_name': obj.business.business_name, 'bid': obj.business.id}"
-    dict = {'content': list_gen(query, item), 'total_count': total_count,
+    dict = {'content': TASK_ITEM(query), 'total_count': total_count,
             'search_by': search_by, 'search_content': search_content,
             'total_page': math.ceil(total_count / length), 'page': page, 'length': length}
 
     return render_template(template, form=dict, form2=form, current_user=current_user, prefix=prefix)
 
 
+def parse_date(value):
+    """解析'YYYY-MM-DD'格式的日期参数
+
+    :param value: 日期字符串
+    :return: datetime，为空或格式不正确时返回None
+    """
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+
+def tasklog_page(task_id, before, after, start, end, length):
+    """按(taskmon_id, id)索引倒序分页查询任务日志
+
+    :param task_id: 任务id
+    :param before: 游标，查询id小于此值的记录（下一页），为空则查询最新记录
+    :param after: 游标，查询id大于此值的记录（上一页）
+    :param start: 开始日期，为空则不限制
+    :param end: 结束日期（包括），为空则不限制
+    :param length: 每页显示记录数
+    :return: 查询条件、当前页记录（id倒序）、是否有更新记录、是否有更早记录
+    """
+    # 按create_datetime过滤，以便mysql对日志分区表进行分区裁剪
+    conditions = [TaskMonitorLog.taskmon_id == task_id]
+    if start:
+        conditions.append(TaskMonitorLog.create_datetime >= start)
+    if end:
+        conditions.append(TaskMonitorLog.create_datetime < end + timedelta(days=1))
+
+    query = TaskMonitorLog.select().where(*conditions)
+    if after:
+        rows = TASKLOG_ITEM(query.where(TaskMonitorLog.id > after).order_by(TaskMonitorLog.id).limit(length + 1))
+        has_newer, has_older = len(rows) > length, True
+        rows = rows[:length][::-1]
+    else:
+        if before:
+            query = query.where(TaskMonitorLog.id < before)
+        rows = TASKLOG_ITEM(query.order_by(TaskMonitorLog.id.desc()).limit(length + 1))
+        has_newer, has_older = bool(before), len(rows) > length
+        rows = rows[:length]
+    return conditions, rows, has_newer, has_older
+
+
 def tasklog_list(db_model, template):
-    """任务日志列表模版渲染
+    """任务日志列表模版渲染（游标分页，记录数统计到TASKLOG_COUNT_LIMIT为止）
 
     :param db_model: 数据库model
     :param template: 模版
     :return: 渲染后的模版
     """
 
-    # 获取请求参数和用户权限以及监控URL公共部分
+    # 获取请求参数和用户权限
     action, id, bid, page, length, search_content, search_by, perm_list = get_parm()
+    before = request.values.get('before', type=int)
+    after = request.values.get('after', type=int)
+    start = parse_date(request.values.get('start'))
+    end = parse_date(request.values.get('end'))
+
+    # 任务不存在或不在用户业务权限内时不显示日志
+    task = TaskMonitor.select(TaskMonitor.id, TaskMonitor.business).where(TaskMonitor.id == id).first()
+    if task is None or (perm_list != SUPERUSER_PERM and str(task.business_id) not in perm_list):
+        rows, total_count, has_newer, has_older = [], 0, False, False
+    else:
+        conditions, rows, has_newer, has_older = tasklog_page(task.id, before, after, start, end, length)
+        total_count = db_model.select(db_model.id).where(*conditions).limit(CFG.TASKLOG_COUNT_LIMIT + 1).count()
 
-    # 模版字典生成（join 'Business' model是因为query_limit函数需要使用Business.id）
-    query_all = 'db_model.select().join(TaskMonitor, on=(TaskMonitorLog.taskmon_id == TaskMonitor.id))' \
-                '.join(Business, on=(TaskMonitor.business == Business.id))' \
-                '.where(TaskMonitor.id==id).order_by(db_model.id.desc()).limit(1000)'
-    query, total_count = query_limit(eval(query_all), True, perm_list, page, length)
-    item = "{'id': obj.id, 'client_ip': obj.client_ip, 'user_agent': obj.user_agent, " \
-           "'create_datetime': obj.create_datetime}"
-    dict = {'content': list_gen(query, item), 'total_count': total_count, 'task_id': id, 'bid': bid,
-            'total_page': math.ceil(total_count / length), 'page': page, 'length': length}
+    # 模版字典生成
+    dict = {'content': rows, 'task_id': id, 'bid': bid, 'length': length,
+            'total_count': min(total_count, CFG.TASKLOG_COUNT_LIMIT),
+            'count_capped': total_count > CFG.TASKLOG_COUNT_LIMIT, 'count_limit': CFG.TASKLOG_COUNT_LIMIT,
+            'start': start.strftime('%Y-%m-%d') if start else '', 'end': end.strftime('%Y-%m-%d') if end else '',
+            'newer': rows[0]['id'] if has_newer and rows else None,
+            'older': rows[-1]['id'] if has_older and rows else None}
 
     return render_template(template, form=dict, current_user=current_user)
 
@@ -576,15 +656,11 @@ def perm_list(db_model, db_model2, form, template):
     if search_content:
         query_all = query_string('where', 'db_model', search_by, search_content, 'db_model2', choice='second')
     else:
-        query_all = query_string('orderby', 'db_model')
+        query_all = query_string('orderby', 'db_model', model2='db_model2')
 
     # 模版字典生成（form2为查询表单）
     query, total_count = query_limit(eval(query_all), False, perm_list, page, length)
-    item = "{'uid': obj.perm_user.id, 'id': obj.id, 'username': obj.perm_user.username, 'perm_list': obj.perm_list, " \
-           "'email': obj.perm_user.email, 'phone': obj.perm_user.phone, 'status': obj.perm_user.status, " \
-           "'api_username': obj.perm_user.api_username, 'api_password': obj.perm_user.api_password, " \
-           "'admin': obj.perm_user.admin}"
-    dict = {'content': list_gen(query, item), 'total_count': total_count,
+    dict = {'content': PERMISSION_ITEM(query), 'total_count': total_count,
             'search_by': search_by, 'search_content': search_content,
             'total_page': math.ceil(total_count / length), 'page': page, 'length': length}
 
@@ -625,6 +701,7 @@ def perm_biz_edit(db_model, form, template):
                 perm_list_new = ' '.join([str(i) for i in form.business.data])
                 query = (db_model.update({db_model.perm_list: perm_list_new}).where(db_model.perm_user == uid))
                 query.execute()
+                set_user_business(uid, form.business.data)
                 flash('修改成功')
             else:
                 utils.flash_errors(form)
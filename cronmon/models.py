@@ -6,8 +6,9 @@ from datetime import datetime
 from flask_login import UserMixin, AnonymousUserMixin
 from itsdangerous import URLSafeSerializer
 from peewee import __exception_wrapper__
-from playhouse.migrate import MySQLDatabase, MySQLMigrator, Model, CharField, DateTimeField, IntegerField, \
-    BooleanField, ForeignKeyField, OperationalError
+from playhouse.pool import PooledMySQLDatabase
+from playhouse.migrate import MySQLDatabase, MySQLMigrator, Model, CharField, DateField, DateTimeField, \
+    IntegerField, BooleanField, ForeignKeyField, TextField, OperationalError
 from werkzeug.security import check_password_hash, generate_password_hash
 from cronmon import login_manager
 from cronmon.conf.config import config
@@ -21,7 +22,7 @@ class RetryOperationalError(object):
             cursor = super(RetryOperationalError, self).execute_sql(sql, params, commit)
         except OperationalError:
             if not self.is_closed():
-                self.close()
+                self.discard_connection()
             with __exception_wrapper__:
                 cursor = self.cursor(commit)
                 cursor.execute(sql, params or ())
@@ -29,14 +30,39 @@ class RetryOperationalError(object):
                     self.commit()
         return cursor
 
+    def discard_connection(self):
+        """关闭出错的连接"""
+        self.close()
+
 
 class RetryDB(RetryOperationalError, MySQLDatabase):
     """封装数据库重试类"""
     pass
 
 
+class RetryPooledDB(RetryOperationalError, PooledMySQLDatabase):
+    """封装连接池数据库重试类"""
+
+    def discard_connection(self):
+        """直接关闭出错的连接，不放回连接池"""
+        self.manual_close()
+
+    def pool_stats(self):
+        """连接池统计信息
+
+        :return: 包括max_connections（最大连接数）、in_use（使用中连接数）和idle（空闲连接数）的字典
+        """
+        return {'max_connections': self._max_connections, 'in_use': len(self._in_use),
+                'idle': len(self._connections)}
+
+
 CFG = config[os.getenv('FLASK_CONFIG') or 'default']
-DB = RetryDB(host=CFG.DB_HOST, user=CFG.DB_USER, passwd=CFG.DB_PASSWD, database=CFG.DB_DATABASE)
+if CFG.DB_POOL:
+    DB = RetryPooledDB(host=CFG.DB_HOST, user=CFG.DB_USER, passwd=CFG.DB_PASSWD, database=CFG.DB_DATABASE,
+                       max_connections=CFG.DB_MAX_CONNECTIONS, stale_timeout=CFG.DB_STALE_TIMEOUT,
+                       timeout=CFG.DB_POOL_TIMEOUT)
+else:
+    DB = RetryDB(host=CFG.DB_HOST, user=CFG.DB_USER, passwd=CFG.DB_PASSWD, database=CFG.DB_DATABASE)
 MIGRATOR = MySQLMigrator(DB)
 SERIALIZER = URLSafeSerializer(CFG.SECRET_KEY)
 
@@ -142,6 +168,18 @@ class BusinessNotifier(BaseModel):
         )
 
 
+class UserBusiness(BaseModel):
+    """用户业务权限model（Permission.perm_list的规范化存储，超级管理员不在此表中）"""
+    user = ForeignKeyField(User)
+    business = ForeignKeyField(Business)
+
+    class Meta:
+        """设置唯一性复合索引"""
+        indexes = (
+            (('user', 'business'), True),
+        )
+
+
 class TaskMonitor(BaseModel):
     """任务model"""
     name = CharField(unique=True)  # 监控任务名
@@ -151,6 +189,7 @@ class TaskMonitor(BaseModel):
     status = BooleanField(default=True)  # 生效失效标识
     last_check_time = DateTimeField(null=True)  # 上次任务检查时间
     next_check_time = DateTimeField(null=True)  # 下次任务检查时间
+    last_ping_time = DateTimeField(null=True)  # 最新请求时间（记录监控请求时同步更新，只增不减）
     warning = BooleanField(default=False)  # 是否处于告警状态
     create_datetime = DateTimeField(default=datetime.now)  # 创建时间
     business = ForeignKeyField(Business, related_name='biz')  # 所属业务
@@ -169,6 +208,13 @@ class TaskMonitorLog(BaseModel):
     user_agent = CharField()  # 客户端类型
     taskmon_id = IntegerField()  # 关联监控任务（此处未使用外键，考虑到插入速度和mysql分区）
 
+    class Meta:
+        """设置监控任务和请求时间复合索引（最新请求时间查询只需读取索引），以及监控任务和id复合索引（任务日志分页）"""
+        indexes = (
+            (('taskmon_id', 'create_datetime'), False),
+            (('taskmon_id', 'id'), False),
+        )
+
 
 class ApiRequestLog(BaseModel):
     """接口请求日志model"""
@@ -181,6 +227,71 @@ class ApiRequestLog(BaseModel):
     user_id = IntegerField()  # 关联监控任务（此处未使用外键，考虑到插入速度和mysql分区）
 
 
+class AlertOutbox(BaseModel):
+    """告警邮件发件箱model"""
+    recipient = CharField()  # 收件人
+    subject = CharField()  # 邮件主题
+    body = TextField()  # 邮件正文
+    status = CharField(default='pending')  # 投递状态，pending（待发送）、sent（已发送）、dead（超过最大重试次数）
+    attempts = IntegerField(default=0)  # 已尝试投递次数
+    next_attempt_time = DateTimeField(default=datetime.now)  # 下次投递时间
+    last_error = CharField(null=True)  # 最近一次投递失败原因
+    create_datetime = DateTimeField(default=datetime.now)  # 创建时间
+
+    class Meta:
+        """设置投递状态和下次投递时间复合索引"""
+        indexes = (
+            (('status', 'next_attempt_time'), False),
+        )
+
+
+class TaskLogDailyStats(BaseModel):
+    """任务日志按天汇总model（由后台任务根据TaskMonitorLog增量汇总）"""
+    taskmon_id = IntegerField()  # 关联监控任务
+    day = DateField()  # 日期
+    count = IntegerField(default=0)  # 当天请求次数
+
+    class Meta:
+        """设置监控任务和日期唯一索引"""
+        indexes = (
+            (('taskmon_id', 'day'), True),
+        )
+
+
+class ApiRequestStats(BaseModel):
+    """接口请求按月汇总model（由后台任务根据ApiRequestLog增量汇总）"""
+    month = IntegerField()  # 年月，如201807
+    endpoint = CharField()  # 接口路径（不包括请求参数）
+    user_id = IntegerField()  # 请求用户
+    count = IntegerField(default=0)  # 当月请求次数
+
+    class Meta:
+        """设置年月、接口路径和用户唯一索引"""
+        indexes = (
+            (('month', 'endpoint', 'user_id'), True),
+        )
+
+
+class StatsWatermark(BaseModel):
+    """汇总任务水位线model，记录每个汇总任务已处理的源表最大id"""
+    name = CharField(unique=True)  # 汇总任务名
+    last_id = IntegerField(default=0)  # 已汇总的最大id
+    seen_id = IntegerField(default=0)  # 上次运行时源表的最大id（本次只汇总到此id，避免遗漏未提交的记录）
+
+
+class CheckerNode(BaseModel):
+    """检查进程心跳model，自动分片模式下按心跳未超时的检查进程分配任务"""
+    name = CharField(unique=True)  # 检查进程名称
+    heartbeat = DateTimeField(default=datetime.now)  # 最近心跳时间
+
+
+class SchedulerLease(BaseModel):
+    """调度租约model，多个节点运行cron.py时只有租约持有者运行主节点任务"""
+    name = CharField(unique=True)  # 租约名称
+    holder = CharField()  # 租约持有者（检查进程名称）
+    expire_time = DateTimeField()  # 租约到期时间
+
+
 class AnonymousUser(AnonymousUserMixin):
     """匿名用户处理"""
     def is_admin(self):
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from cronmon import get_logger, get_config
+from cronmon.batchwriter import at_shutdown
+from cronmon.email import send_email
+from cronmon.models import DB, AlertOutbox
+
+
+LOGGER = get_logger(__name__)
+CFG = get_config()
+# 投递线程池（长期存在，以便每个投递线程复用各自的SMTP连接）
+POOL = None
+# 摘要模式下等待合并的告警，以及第一条告警加入的时间
+_DIGEST = []
+_DIGEST_SINCE = None
+_DIGEST_LOCK = threading.Lock()
+_DIGEST_REGISTERED = False
+
+
+def digest(infolist):
+    """按收件人合并告警，同一收件人的多条告警合并为一封列出全部任务的邮件
+
+    :param infolist: 一个由列表组成的列表，每个子列表包含收件人，正文和主体三部分信息
+    :return: 合并后的列表
+    """
+    grouped = OrderedDict()
+    for info in infolist:
+        grouped.setdefault(info[0], []).append(info)
+
+    result = []
+    for recipient, infos in grouped.items():
+        if len(infos) == 1:
+            result.append(infos[0])
+            continue
+        down = len([info for info in infos if info[2] == 'Status is Down'])
+        subject = 'Status Digest - %d Down, %d Up' % (down, len(infos) - down)
+        body = "\n".join(info[1] + ' : ' + info[2] for info in infos)
+        result.append([recipient, body, subject])
+    return result
+
+
+def collect_digest(infolist):
+    """累积告警，距第一条告警超过ALERT_DIGEST_WINDOW秒后返回合并后的告警，否则返回空列表"""
+    global _DIGEST_SINCE, _DIGEST_REGISTERED
+    with _DIGEST_LOCK:
+        _DIGEST.extend(infolist)
+        if not _DIGEST:
+            return []
+        now = time.monotonic()
+        if _DIGEST_SINCE is None:
+            _DIGEST_SINCE = now
+        if not _DIGEST_REGISTERED:
+            _DIGEST_REGISTERED = True
+            at_shutdown(flush_digest)
+        if now - _DIGEST_SINCE < CFG.ALERT_DIGEST_WINDOW:
+            return []
+        pending = _DIGEST[:]
+        del _DIGEST[:]
+        _DIGEST_SINCE = None
+    return digest(pending)
+
+
+def flush_digest():
+    """立即发送全部等待合并的告警（进程退出时调用）"""
+    global _DIGEST_SINCE
+    with _DIGEST_LOCK:
+        pending = _DIGEST[:]
+        del _DIGEST[:]
+        _DIGEST_SINCE = None
+    if pending:
+        send_alerts(digest(pending))
+
+
+def send_alerts(infolist, digest_mode=False):
+    """发送告警邮件，开启ALERT_OUTBOX时写入发件箱由后台任务投递，否则直接发送
+
+    :param infolist: 一个由列表组成的列表，每个子列表包含收件人，正文和主体三部分信息
+    :param digest_mode: 开启ALERT_DIGEST时是否按收件人合并（用于任务状态变化告警）
+    :return: 无
+    """
+    if digest_mode and CFG.ALERT_DIGEST:
+        infolist = collect_digest(infolist)
+
+    if not CFG.ALERT_OUTBOX:
+        send_email(infolist)
+        return
+
+    if not infolist:
+        return
+    rows = [(info[0], info[2], info[1]) for info in infolist]
+    with DB.atomic():
+        AlertOutbox.insert_many(rows, fields=[AlertOutbox.recipient, AlertOutbox.subject, AlertOutbox.body]).execute()
+    for info in infolist:
+        msg = 'Queue mail to ' + info[0] + ': ' + info[2] + ' --- ' + info[1]
+        LOGGER.warn(msg)
+
+
+def deliver(alert):
+    """投递一封告警邮件
+
+    :param alert: AlertOutbox对象
+    :return: 投递失败原因，投递成功则返回None
+    """
+    try:
+        send_email([[alert.recipient, alert.body, alert.subject]])
+    except Exception as err:
+        return str(err)[:255] or err.__class__.__name__
+    return None
+
+
+def drain():
+    """发件箱投递任务，并发投递已到投递时间的待发送邮件，失败后按指数退避重试，超过最大重试次数则标记为dead"""
+    global POOL
+    if not CFG.ALERT_OUTBOX:
+        return
+
+    now = datetime.now()
+    alerts = list(AlertOutbox.select()
+                  .where(AlertOutbox.status == 'pending', AlertOutbox.next_attempt_time <= now)
+                  .order_by(AlertOutbox.id)
+                  .limit(CFG.ALERT_OUTBOX_BATCH))
+    if not alerts:
+        return
+
+    if POOL is None:
+        POOL = ThreadPoolExecutor(max_workers=CFG.ALERT_OUTBOX_WORKERS)
+    errors = list(POOL.map(deliver, alerts))
+
+    sent = [alert.id for alert, error in zip(alerts, errors) if error is None]
+    if sent:
+        AlertOutbox.update(status='sent', attempts=AlertOutbox.attempts + 1)\
+            .where(AlertOutbox.id.in_(sent)).execute()
+
+    for alert, error in zip(alerts, errors):
+        if error is None:
+            continue
+        attempts = alert.attempts + 1
+        if attempts >= CFG.ALERT_OUTBOX_MAX_ATTEMPTS:
+            status = 'dead'
+            LOGGER.error('Mail to %s dead after %d attempts: %s', alert.recipient, attempts, error)
+        else:
+            status = 'pending'
+            LOGGER.warn('Mail to %s failed (attempt %d): %s', alert.recipient, attempts, error)
+        delay = min(CFG.ALERT_OUTBOX_RETRY_BASE * 2 ** (attempts - 1), CFG.ALERT_OUTBOX_RETRY_MAX)
+        AlertOutbox.update(status=status, attempts=attempts, last_error=error,
+                           next_attempt_time=now + timedelta(seconds=delay))\
+            .where(AlertOutbox.id == alert.id).execute()
@@ -0,0 +1,74 @@
+from flask import g, has_app_context
+from cronmon import get_config
+from cronmon.cache import LRUCache
+from cronmon.models import DB, Permission, Business, UserBusiness
+
+
+CFG = get_config()
+
+SUPERUSER_PERM = frozenset(['0'])  # 超级管理员业务权限（全部业务）
+# 用户业务权限缓存，以用户id为键（每个进程各自缓存，其他进程中的修改最迟PERM_CACHE_TTL秒后生效）
+PERM_CACHE = LRUCache(CFG.PERM_CACHE_SIZE, CFG.PERM_CACHE_TTL)
+
+
+def get_perm_list(user_id):
+    """获取用户业务权限，同一请求内只查询一次，并在进程内缓存PERM_CACHE_TTL秒
+
+    :param user_id: 用户id
+    :return: 业务id集合（frozenset，元素为字符串），超级管理员为SUPERUSER_PERM
+    """
+    request_cache = g.setdefault('perm_lists', {}) if has_app_context() else {}
+    perm_list = request_cache.get(user_id)
+    if perm_list is not None:
+        return perm_list
+
+    perm_list = PERM_CACHE.get(user_id) if CFG.PERM_CACHE_TTL > 0 else None
+    if perm_list is None:
+        perm_list = frozenset(Permission.select().where(Permission.perm_user == user_id).get().perm_list.split())
+        if CFG.PERM_CACHE_TTL > 0:
+            PERM_CACHE.set(user_id, perm_list)
+    request_cache[user_id] = perm_list
+    return perm_list
+
+
+def perm_invalidate(user_id):
+    """使用户业务权限缓存失效（修改perm_list后调用）
+
+    :param user_id: 用户id
+    :return: 无
+    """
+    user_id = int(user_id)
+    PERM_CACHE.pop(user_id)
+    if has_app_context():
+        g.setdefault('perm_lists', {}).pop(user_id, None)
+
+
+def perm_business(user_id):
+    """用户有权限的业务id子查询，用于'Business.id.in_(...)'过滤（按UserBusiness的用户和业务复合索引查询）
+
+    :param user_id: 用户id
+    :return: 子查询
+    """
+    return UserBusiness.select(UserBusiness.business).where(UserBusiness.user == user_id)
+
+
+def set_user_business(user_id, perm_list):
+    """按perm_list重写用户的UserBusiness记录（修改Permission.perm_list后调用），并使业务权限缓存失效
+
+    :param user_id: 用户id
+    :param perm_list: 业务id列表，包括'0'（超级管理员）时不保存任何记录
+    :return: 无
+    """
+    business_ids = set(int(i) for i in perm_list)
+    if 0 in business_ids:
+        business_ids = set()
+    # 只保存仍存在的业务
+    if business_ids:
+        query = Business.select(Business.id).where(Business.id.in_(list(business_ids))).tuples()
+        business_ids = set(business_id for business_id, in query)
+    with DB.atomic():
+        UserBusiness.delete().where(UserBusiness.user == user_id).execute()
+        if business_ids:
+            UserBusiness.insert_many([(user_id, i) for i in sorted(business_ids)],
+                                     fields=[UserBusiness.user, UserBusiness.business]).execute()
+    perm_invalidate(user_id)
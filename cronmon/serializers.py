@@ -0,0 +1,59 @@
+from cronmon.models import User, Permission, Notifier, Business, BusinessNotifier, TaskMonitor, TaskMonitorLog
+
+
+class Serializer(object):
+    """查询结果序列化器，字段定义在创建时编译为带别名的查询列，序列化时只查询这些列
+
+    关联表字段（如Business.business_name）通过查询语句中已有的join在同一条SQL中取得，
+    每页只需一次查询，查询结果由数据库驱动直接生成字典，不再逐行创建model对象。
+    """
+
+    def __init__(self, *fields):
+        """
+        :param fields: (键名, model字段)元组，键名即输出字典的键
+        """
+        self.fields = fields
+        self.keys = [key for key, field in fields]
+        self.columns = [field.alias(key) for key, field in fields]
+
+    def extend(self, *fields):
+        """生成增加了字段的新序列化器"""
+        return Serializer(*(self.fields + fields))
+
+    def __call__(self, query):
+        """序列化查询结果
+
+        :param query: 查询语句（需已join字段所在的model）
+        :return: 字典列表
+        """
+        return list(query.select(*self.columns).dicts())
+
+
+BUSINESS_ITEM = Serializer(('business_name', Business.business_name), ('id', Business.id),
+                           ('status', Business.status))
+
+NOTIFIER_ITEM = Serializer(('id', Notifier.id), ('notify_name', Notifier.notify_name),
+                           ('notify_email', Notifier.notify_email), ('notify_tel', Notifier.notify_tel),
+                           ('status', Notifier.status))
+
+BUSINESS_NOTIFIER_ITEM = Serializer(('business_name', Business.business_name), ('id', BusinessNotifier.id),
+                                    ('notify_name', Notifier.notify_name), ('bid', BusinessNotifier.business))
+
+TASK_ITEM = Serializer(('warning', TaskMonitor.warning), ('name', TaskMonitor.name), ('id', TaskMonitor.id),
+                       ('url', TaskMonitor.url), ('period', TaskMonitor.period),
+                       ('grace_time', TaskMonitor.grace_time), ('status', TaskMonitor.status),
+                       ('business_name', Business.business_name), ('bid', TaskMonitor.business))
+
+TASKLOG_ITEM = Serializer(('id', TaskMonitorLog.id), ('client_ip', TaskMonitorLog.client_ip),
+                          ('user_agent', TaskMonitorLog.user_agent),
+                          ('create_datetime', TaskMonitorLog.create_datetime))
+
+PERMISSION_ITEM = Serializer(('uid', Permission.perm_user), ('id', Permission.id), ('username', User.username),
+                             ('perm_list', Permission.perm_list), ('email', User.email), ('phone', User.phone),
+                             ('status', User.status), ('api_username', User.api_username),
+                             ('api_password', User.api_password), ('admin', User.admin))
+
+# API接口输出的任务信息（不包括任务id）
+API_TASK_ITEM = Serializer(('name', TaskMonitor.name), ('url', TaskMonitor.url), ('period', TaskMonitor.period),
+                           ('grace_time', TaskMonitor.grace_time), ('status', TaskMonitor.status),
+                           ('warning', TaskMonitor.warning), ('business_name', Business.business_name))
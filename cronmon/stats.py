@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+from peewee import fn, IntegrityError
+from cronmon import get_logger, get_config
+from cronmon.cache import LRUCache
+from cronmon.models import DB, TaskMonitorLog, TaskLogDailyStats, ApiRequestLog, ApiRequestStats, StatsWatermark
+
+
+LOGGER = get_logger(__name__)
+CFG = get_config()
+
+# 首页dashboard数据缓存，以用户业务权限为键
+DASHBOARD_CACHE = LRUCache(1024, CFG.STATS_CACHE_TTL)
+
+
+def advance(name, model, rollup_range):
+    """按水位线增量汇总，每批在一个事务中完成水位线更新和汇总
+
+    每次运行只汇总到上次运行时记录的源表最大id，避免遗漏id已分配但尚未提交的记录。
+    每批先以带条件的UPDATE（last_id仍为区间下限）占用id区间，多个节点同时运行时只有一个占用成功，
+    其他运行不再汇总此区间，避免重复累加
+
+    :param name: 汇总任务名
+    :param model: 源表model（按自增id增量读取）
+    :param rollup_range: 汇总函数，参数为id区间(low, high]
+    :return: 本次汇总的id区间上限
+    """
+    mark = StatsWatermark.get_or_none(StatsWatermark.name == name)
+    if mark is None:
+        try:
+            mark = StatsWatermark.create(name=name)
+        except IntegrityError:
+            mark = StatsWatermark.get(StatsWatermark.name == name)
+    max_id = model.select(fn.MAX(model.id)).scalar() or 0
+
+    low = mark.last_id
+    while low < mark.seen_id:
+        high = min(low + CFG.STATS_ROLLUP_BATCH, mark.seen_id)
+        with DB.atomic():
+            claimed = StatsWatermark.update(last_id=high)\
+                .where(StatsWatermark.name == name, StatsWatermark.last_id == low).execute()
+            if not claimed:
+                LOGGER.info('Stats rollup %s: id range after %d already claimed by another run', name, low)
+                break
+            rollup_range(low, high)
+        low = high
+
+    StatsWatermark.update(seen_id=fn.GREATEST(StatsWatermark.seen_id, max_id, low))\
+        .where(StatsWatermark.name == name).execute()
+    return low
+
+
+def rollup_tasklog_range(low, high):
+    """将指定id区间的任务日志按任务和日期汇总，累加到TaskLogDailyStats
+
+    :param low: 区间下限（不包括）
+    :param high: 区间上限（包括）
+    :return: 无
+    """
+    day = fn.DATE(TaskMonitorLog.create_datetime)
+    rows = list(TaskMonitorLog.select(TaskMonitorLog.taskmon_id, day, fn.COUNT(TaskMonitorLog.id))
+                .where(TaskMonitorLog.id > low, TaskMonitorLog.id <= high)
+                .group_by(TaskMonitorLog.taskmon_id, day).tuples())
+    if not rows:
+        return
+    TaskLogDailyStats.insert_many(rows, fields=[TaskLogDailyStats.taskmon_id, TaskLogDailyStats.day,
+                                                TaskLogDailyStats.count])\
+        .on_conflict(update={TaskLogDailyStats.count: TaskLogDailyStats.count + fn.VALUES(TaskLogDailyStats.count)})\
+        .execute()
+
+
+def rollup_apirequest_range(low, high):
+    """将指定id区间的接口请求日志按年月、接口路径和用户汇总，累加到ApiRequestStats
+
+    :param low: 区间下限（不包括）
+    :param high: 区间上限（包括）
+    :return: 无
+    """
+    month = fn.DATE_FORMAT(ApiRequestLog.create_datetime, '%Y%m')
+    endpoint = fn.SUBSTRING_INDEX(ApiRequestLog.url, '?', 1)
+    rows = list(ApiRequestLog.select(month, endpoint, ApiRequestLog.user_id, fn.COUNT(ApiRequestLog.id))
+                .where(ApiRequestLog.id > low, ApiRequestLog.id <= high)
+                .group_by(month, endpoint, ApiRequestLog.user_id).tuples())
+    if not rows:
+        return
+    ApiRequestStats.insert_many(rows, fields=[ApiRequestStats.month, ApiRequestStats.endpoint,
+                                              ApiRequestStats.user_id, ApiRequestStats.count])\
+        .on_conflict(update={ApiRequestStats.count: ApiRequestStats.count + fn.VALUES(ApiRequestStats.count)})\
+        .execute()
+
+
+def api_request_months(months):
+    """获取接口请求按月统计数据（首页图表数据）
+
+    :param months: 年月列表，如[201807, 201808]
+    :return: tasks/all接口和tasks接口的请求次数列表，与年月列表一一对应
+    """
+    tasks_all = dict.fromkeys(months, 0)
+    tasks = dict.fromkeys(months, 0)
+    query = ApiRequestStats.select(ApiRequestStats.month, ApiRequestStats.endpoint, fn.SUM(ApiRequestStats.count))\
+        .where(ApiRequestStats.month.in_(months))\
+        .group_by(ApiRequestStats.month, ApiRequestStats.endpoint).tuples()
+    for month, endpoint, count in query:
+        if endpoint.endswith('/tasks/all'):
+            tasks_all[month] += int(count)
+        elif endpoint.endswith('/tasks'):
+            tasks[month] += int(count)
+    return [tasks_all[month] for month in months], [tasks[month] for month in months]
+
+
+def prune_tasklog_stats():
+    """删除超过任务日志保留天数（TASKLOG_KEEP_DAYS）的按天汇总记录，对应的日志分区已被删除
+
+    :return: 删除的记录数
+    """
+    keep_day = (datetime.now() - timedelta(days=CFG.TASKLOG_KEEP_DAYS)).date()
+    return TaskLogDailyStats.delete().where(TaskLogDailyStats.day < keep_day).execute()
+
+
+def rollup():
+    """统计汇总任务，增量汇总新增的任务日志和接口请求日志，并清理过期的任务日志汇总记录"""
+    tasklog_id = advance('tasklog', TaskMonitorLog, rollup_tasklog_range)
+    prune_tasklog_stats()
+    apirequest_id = advance('apirequest', ApiRequestLog, rollup_apirequest_range)
+    LOGGER.debug('Stats rollup: tasklog up to id %d, apirequest up to id %d', tasklog_id, apirequest_id)
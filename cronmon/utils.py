@@ -1,3 +1,5 @@
+import base64
+import binascii
 from functools import wraps
 import random
 from flask import abort, flash
@@ -6,19 +8,30 @@ from PIL import Image, ImageDraw, ImageFont, ImageFilter
 from werkzeug.security import generate_password_hash
 
 
-def list_gen(query, item):
-    """查询结果列表生成（每一个列表项为一个相关键值的字符串）
+def encode_cursor(*values):
+    """生成分页游标（对客户端不透明的字符串）
 
-    :param query: 查询语句
-    :param item: 包括相关查询查询键值的字典字符串（需要eval进行转换，转换后则包括了obj）
-    :return: 查询结果列表
+    :param values: 游标包含的值（如记录id）
+    :return: 游标字符串
     """
+    raw = ':'.join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
 
-    list = []
-    for obj in query:
-        dict = eval(item)
-        list.append(dict)
-    return list
+
+def decode_cursor(cursor):
+    """解析分页游标
+
+    :param cursor: 游标字符串
+    :return: 游标包含的值列表（字符串），游标为空则返回空列表
+    :raise ValueError: 游标格式不正确
+    """
+    if not cursor:
+        return []
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+    return raw.split(':')
 
 
 def dict_to_obj(dict, obj):
@@ -1,26 +1,34 @@
 import os
+from datetime import datetime
 from playhouse.migrate import migrate, CharField, BooleanField, ForeignKeyField
 from flask_script import Manager
 from werkzeug.security import generate_password_hash
 from cronmon import create_app
-from cronmon.models import User, Permission, Notifier, Business, BusinessNotifier, TaskMonitor, TaskMonitorLog,\
-    ApiRequestLog, BaseModel, DB, MIGRATOR
+from cronmon.perm import set_user_business
+from cronmon.api.ping import update_last_ping, ping_query
+from cronmon.models import User, Permission, Notifier, Business, BusinessNotifier, UserBusiness, TaskMonitor, \
+    TaskMonitorLog, ApiRequestLog, AlertOutbox, TaskLogDailyStats, ApiRequestStats, StatsWatermark, CheckerNode, \
+    SchedulerLease, BaseModel, DB, MIGRATOR
 
 
 # 创建app，初始化manager
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 manager = Manager(app)
+BACKFILL_CHUNK = 1000  # 回填最新请求时间时每批任务数
 
 
 def create_table():
     """初始化数据库表结构，包括所有model，后续调整使用migrate.py"""
-    DB.create_tables([User, Permission, Notifier, Business, BusinessNotifier, TaskMonitor, TaskMonitorLog,
-                      ApiRequestLog])
+    DB.create_tables([User, Permission, Notifier, Business, BusinessNotifier, UserBusiness, TaskMonitor, TaskMonitorLog,
+                      ApiRequestLog, AlertOutbox, TaskLogDailyStats, ApiRequestStats, StatsWatermark, CheckerNode,
+                      SchedulerLease])
 
 
 def drop_table():
     """初始化数据库表结构，包括所有model，后续调整使用migrate.py"""
-    DB.drop_tables([User, Permission, Notifier, Business, BusinessNotifier, TaskMonitor, TaskMonitorLog, ApiRequestLog])
+    DB.drop_tables([User, Permission, Notifier, Business, BusinessNotifier, UserBusiness, TaskMonitor, TaskMonitorLog,
+                    ApiRequestLog, AlertOutbox, TaskLogDailyStats, ApiRequestStats, StatsWatermark, CheckerNode,
+                    SchedulerLease])
 
 
 def insert_first_admin():
@@ -62,6 +70,63 @@ def reinit():
         print('终止操作')
 
 
+@manager.command
+def upgrade():
+    """升级已有系统的表结构，创建新版本增加的表（已存在的表不做修改），并转换已有的业务权限"""
+    DB.create_tables([AlertOutbox, TaskLogDailyStats, ApiRequestStats, StatsWatermark, UserBusiness, CheckerNode,
+                      SchedulerLease], safe=True)
+    add_index('taskmonitorlog', ('taskmon_id', 'create_datetime'))
+    add_index('taskmonitorlog', ('taskmon_id', 'id'))
+    if add_column('taskmonitor', 'last_ping_time', TaskMonitor.last_ping_time):
+        backfill_last_ping()
+    convert_perm()
+
+
+def add_column(table, name, field):
+    """增加字段（已存在同名字段则跳过）
+
+    :param table: 表名
+    :param name: 字段名
+    :param field: peewee字段定义
+    :return: 是否新增了字段
+    """
+    if name in [column.name for column in DB.get_columns(table)]:
+        return False
+    print('增加字段 %s.%s' % (table, name))
+    migrate(MIGRATOR.add_column(table, name, field))
+    return True
+
+
+@manager.command
+def backfill_last_ping():
+    """根据任务日志回填TaskMonitor.last_ping_time（可重复执行，按任务分批，只读取taskmon_id和create_datetime索引）"""
+    task_ids = [task.id for task in TaskMonitor.select(TaskMonitor.id)]
+    for i in range(0, len(task_ids), BACKFILL_CHUNK):
+        update_last_ping(dict(ping_query(task_ids[i:i + BACKFILL_CHUNK], datetime.min)))
+
+
+def add_index(table, columns, unique=False):
+    """增加索引（已存在同名索引则跳过），索引名和peewee model中定义的索引一致
+
+    :param table: 表名
+    :param columns: 索引列元组
+    :param unique: 是否唯一性索引
+    :return: 无
+    """
+    name = '_'.join((table,) + tuple(columns))
+    if name in [index.name for index in DB.get_indexes(table)]:
+        return
+    print('增加索引 %s（数据量较大时需要较长时间）' % name)
+    migrate(MIGRATOR.add_index(table, columns, unique))
+
+
+@manager.command
+def convert_perm():
+    """将Permission.perm_list中的业务权限转换为UserBusiness记录（可重复执行）"""
+    for user_id, perm_list in Permission.select(Permission.perm_user, Permission.perm_list).tuples():
+        set_user_business(user_id, perm_list.split())
+
+
 # 业务表样例数据
 business_fields = [Business.business_name, Business.status]
 business_data = [
@@ -162,6 +227,7 @@ def sample():
     TaskMonitor.insert_many(taskmonitor_data, fields=taskmonitor_fields).execute()
     User.insert_many(user_data, fields=user_fields).execute()
     Permission.insert_many(permission_data, fields=permission_fields).execute()
+    convert_perm()
 
 
 # model定义
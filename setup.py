@@ -37,6 +37,9 @@ setup(
     zip_safe=False,
     exclude_package_data={'':['.gitignore']},
     install_requires=find_install_requires(),
+    entry_points={
+        'console_scripts': ['cronmon-ingest = cronmon.ingest:main'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'Environment :: Console',
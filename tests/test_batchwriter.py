@@ -0,0 +1,54 @@
+"""写缓冲测试，包括错误记录拆分丢弃以及可重试异常时记录放回缓冲"""
+from cronmon.batchwriter import BatchWriter
+
+
+class TestBatchWriter:
+    """Batch writer tests."""
+
+    def test_reject_bad_row(self):
+        """Drop a bad row without blocking the other rows."""
+        written = []
+
+        def sink(rows):
+            if 'bad' in rows:
+                raise ValueError('bad row')
+            written.extend(rows)
+
+        writer = BatchWriter(sink, retry_errors=(ConnectionError,))
+        for row in ['a', 'b', 'bad', 'c', 'd']:
+            writer.add(row)
+        writer.flush()
+        assert written == ['a', 'b', 'c', 'd']
+        assert writer.stats()['rejected'] == 1
+        assert writer.stats()['pending'] == 0
+
+    def test_retry_rows(self):
+        """Put rows back into the buffer on retryable errors."""
+        down = [True]
+        written = []
+
+        def sink(rows):
+            if down[0]:
+                raise ConnectionError('database is down')
+            written.extend(rows)
+
+        writer = BatchWriter(sink, retry_errors=(ConnectionError,))
+        writer.add('a')
+        writer.add('b')
+        writer.flush()
+        assert writer.stats()['pending'] == 2
+        down[0] = False
+        writer.flush()
+        assert written == ['a', 'b']
+        assert writer.stats()['rejected'] == 0
+
+    def test_non_blocking_add(self):
+        """Don't write in the calling thread when the buffer is full and block is False."""
+        written = []
+        writer = BatchWriter(written.extend, max_size=1)
+        assert writer.add('a', block=False)
+        assert not writer.add('b', block=False)
+        assert written == []
+        assert writer.stats()['dropped'] == 0
+        assert writer.add('b')
+        assert written == ['a']
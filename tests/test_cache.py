@@ -0,0 +1,51 @@
+"""进程内缓存测试，包括LRU淘汰、TTL过期以及命中统计"""
+import time
+from cronmon.cache import LRUCache
+
+
+class TestLRUCache:
+    """LRU cache tests."""
+
+    def test_hit_and_miss(self):
+        """Count hits and misses."""
+        cache = LRUCache(maxsize=10, ttl=60)
+        assert cache.get('a') is None
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+    def test_negative_value(self):
+        """Cache None as a value."""
+        cache = LRUCache(maxsize=10, ttl=60)
+        cache.set('a', None)
+        assert cache.get('a', False) is None
+        assert cache.get('b', False) is False
+
+    def test_lru_eviction(self):
+        """Evict least recently used entry."""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+    def test_ttl_expire(self):
+        """Expire entry after ttl."""
+        cache = LRUCache(maxsize=10, ttl=0.01)
+        cache.set('a', 1)
+        time.sleep(0.02)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_invalidate(self):
+        """Pop and clear entries."""
+        cache = LRUCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.pop('a')
+        assert cache.get('a') is None
+        cache.clear()
+        assert len(cache) == 0
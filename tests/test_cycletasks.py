@@ -1,7 +1,18 @@
 """后台定时任务测试，通过监控日志实现，计划任务运行后，在一定时间段内，如果有符合关键字的文本出现，则认为符合预期，反之则不然
 此文件测试用例依赖于初始化脚本中的样本数据，如果数据有过更改，则有可能会导致测试失败
 """
-from cronmon.main.taskcyclecheck import taskcyclecheck, emptybusinesscheck
+from datetime import datetime, timedelta
+import pytest
+from peewee import fn
+from cronmon.main import taskcyclecheck as taskcyclecheck_module
+from cronmon.main.taskcyclecheck import taskcyclecheck, emptybusinesscheck, load_tasks, evaluate_all, CFG
+from cronmon.main.deadline import DEADLINE_QUEUE, notify_task_change
+from cronmon.main.shard import current_shard, shard_conditions
+from cronmon.lease import acquire_lease, release_lease, leader_jobs
+from cronmon.models import TaskMonitor, TaskMonitorLog, ApiRequestLog, AlertOutbox, TaskLogDailyStats, CheckerNode, \
+    StatsWatermark
+from cronmon.outbox import send_alerts, drain, digest
+from cronmon.stats import rollup, advance, rollup_tasklog_range, api_request_months
 
 
 class TestCycleTasks:
@@ -16,3 +27,161 @@ class TestCycleTasks:
         """Check monitor jobs."""
         taskcyclecheck()
         assert 'Status is' not in caplog.text
+
+    def test_deadline_job(self, monkeypatch):
+        """Check monitor jobs in deadline mode."""
+        monkeypatch.setattr(CFG, 'CHECK_MODE', 'deadline')
+        notify_task_change()
+        taskcyclecheck()
+        assert len(DEADLINE_QUEUE) == TaskMonitor.select().where(TaskMonitor.status == 1).count()
+
+    @pytest.mark.usefixtures('db')
+    def test_deadline_multi_node_resync(self, monkeypatch):
+        """Check tasks changed on another node are picked up by the short resync."""
+        monkeypatch.setattr(CFG, 'SCHEDULER_LEASE', True)
+        monkeypatch.setattr(CFG, 'DEADLINE_RESYNC_MULTI', 0)
+        DEADLINE_QUEUE.rebuild()
+        task = TaskMonitor.select().where(TaskMonitor.status == 1).get()
+        TaskMonitor.update(status=False).where(TaskMonitor.id == task.id).execute()
+        due = DEADLINE_QUEUE.pop_due(datetime.min)
+        assert task.id not in due
+        assert len(due) + len(DEADLINE_QUEUE) == TaskMonitor.select().where(TaskMonitor.status == 1).count()
+
+    def test_check_isolation(self, monkeypatch, caplog):
+        """Check a task with invalid period doesn't abort the other tasks, serially and on the pool."""
+        now = datetime.now()
+        tasks = [{'id': i, 'name': 'task%d' % i, 'period': '* * * * *', 'grace_time': 0, 'last_check_time': now,
+                  'next_check_time': None, 'warning': False, 'create_datetime': now, 'emails': []}
+                 for i in range(1, 6)]
+        tasks[2]['period'] = 'a b c d e'
+        monkeypatch.setattr(taskcyclecheck_module, 'POOL', None)
+        monkeypatch.setattr(CFG, 'CHECK_POOL_CHUNK', 2)
+        for workers in (0, 2):
+            monkeypatch.setattr(CFG, 'CHECK_WORKERS', workers)
+            updates, infolist = evaluate_all(tasks, int(now.timestamp()), {})
+            assert sorted(updates) == [1, 2, 4, 5]
+        assert 'TASK task3 : check failed' in caplog.text
+        taskcyclecheck_module.POOL.shutdown()
+
+    @pytest.mark.usefixtures('db')
+    def test_sharded_check(self, monkeypatch):
+        """Check each shard owns a disjoint slice of tasks."""
+        all_ids = set(task['id'] for task in load_tasks())
+        shard_ids = set()
+        monkeypatch.setattr(CFG, 'CHECK_SHARDS', 3)
+        for index in range(3):
+            monkeypatch.setattr(CFG, 'CHECK_SHARD_INDEX', index)
+            ids = set(task['id'] for task in load_tasks(*shard_conditions(current_shard())))
+            assert all(task_id % 3 == index for task_id in ids)
+            shard_ids |= ids
+        assert shard_ids == all_ids
+
+        # Automatic sharding by alive checker nodes
+        monkeypatch.setattr(CFG, 'CHECK_SHARDS', 0)
+        monkeypatch.setattr(CFG, 'CHECK_NODE_NAME', 'node-b')
+        assert current_shard() is None
+        CheckerNode.create(name='node-a')
+        assert current_shard() == (2, 1)
+
+    @pytest.mark.usefixtures('db')
+    def test_scheduler_lease(self):
+        """Check only one node holds the scheduler lease."""
+        assert acquire_lease('test', 'node-a', 30)
+        assert not acquire_lease('test', 'node-b', 30)
+        assert acquire_lease('test', 'node-a', 30)
+
+        # Released or expired lease is taken over by standby node
+        release_lease('test', 'node-a')
+        assert acquire_lease('test', 'node-b', 30)
+        assert not acquire_lease('test', 'node-a', 30)
+        assert acquire_lease('test', 'node-b', -1)
+        assert acquire_lease('test', 'node-a', 30)
+
+    def test_leader_jobs(self, monkeypatch):
+        """Check the check job runs on every node in sharded check mode."""
+        assert 'job1' in leader_jobs()
+        monkeypatch.setattr(CFG, 'CHECK_SHARDS', 3)
+        assert 'job1' not in leader_jobs()
+        assert 'job2' in leader_jobs()
+
+    @pytest.mark.usefixtures('db')
+    def test_alert_outbox(self, monkeypatch, caplog):
+        """Queue alerts in outbox and deliver them."""
+        monkeypatch.setattr(CFG, 'ALERT_OUTBOX', True)
+        send_alerts([['outbox@cronmon.com', 'outboxTask', 'Status is Down']])
+        assert 'Queue mail to outbox@cronmon.com' in caplog.text
+        alert = AlertOutbox.get(AlertOutbox.recipient == 'outbox@cronmon.com')
+        assert alert.status == 'pending'
+
+        drain()
+        alert = AlertOutbox.get_by_id(alert.id)
+        assert alert.status == 'sent'
+        assert alert.attempts == 1
+
+    def test_alert_digest(self):
+        """Merge alerts per recipient."""
+        infolist = [['a@cronmon.com', 'task1', 'Status is Down'], ['b@cronmon.com', 'task1', 'Status is Down'],
+                    ['a@cronmon.com', 'task2', 'Status is Down'], ['a@cronmon.com', 'task3', 'Status is Up']]
+        result = digest(infolist)
+        assert len(result) == 2
+        assert result[0] == ['a@cronmon.com', 'task1 : Status is Down\ntask2 : Status is Down\ntask3 : Status is Up',
+                             'Status Digest - 2 Down, 1 Up']
+        assert result[1] == ['b@cronmon.com', 'task1', 'Status is Down']
+
+    @pytest.mark.usefixtures('db')
+    def test_stats_rollup(self):
+        """Roll up task logs into daily stats incrementally."""
+        task = TaskMonitor.select().get()
+        rollup()
+        rollup()
+        before = TaskLogDailyStats.select(fn.SUM(TaskLogDailyStats.count))\
+            .where(TaskLogDailyStats.taskmon_id == task.id).scalar() or 0
+        for i in range(3):
+            TaskMonitorLog.create(client_ip='127.0.0.1', user_agent='rollup', taskmon_id=task.id)
+        rollup()
+        rollup()
+        after = TaskLogDailyStats.select(fn.SUM(TaskLogDailyStats.count))\
+            .where(TaskLogDailyStats.taskmon_id == task.id).scalar()
+        assert after - before == 3
+
+    @pytest.mark.usefixtures('db')
+    def test_stats_overlapping_rollup(self, monkeypatch):
+        """Overlapping rollup runs don't count the same id range twice."""
+        task = TaskMonitor.select().get()
+        rollup()
+        for i in range(3):
+            TaskMonitorLog.create(client_ip='127.0.0.1', user_agent='rollup', taskmon_id=task.id)
+        rollup()
+        stale = StatsWatermark.get(StatsWatermark.name == 'tasklog')
+        rollup()
+        total = TaskLogDailyStats.select(fn.SUM(TaskLogDailyStats.count)).scalar()
+
+        # A second run started with the watermark read before the first run claimed the range
+        monkeypatch.setattr(StatsWatermark, 'get_or_none', classmethod(lambda cls, *query: stale))
+        advance('tasklog', TaskMonitorLog, rollup_tasklog_range)
+        assert TaskLogDailyStats.select(fn.SUM(TaskLogDailyStats.count)).scalar() == total
+
+    @pytest.mark.usefixtures('db')
+    def test_stats_prune(self):
+        """Drop daily stats older than the task log retention."""
+        task = TaskMonitor.select().get()
+        old_day = (datetime.now() - timedelta(days=CFG.TASKLOG_KEEP_DAYS + 1)).date()
+        TaskLogDailyStats.create(taskmon_id=task.id, day=old_day, count=5)
+        rollup()
+        assert not TaskLogDailyStats.select().where(TaskLogDailyStats.day == old_day).exists()
+
+    @pytest.mark.usefixtures('db')
+    def test_api_request_stats(self):
+        """Roll up api request logs into monthly stats incrementally."""
+        month = int(datetime.now().strftime('%Y%m'))
+        rollup()
+        rollup()
+        before = api_request_months([month])
+        for url in ('/api/v1.0/tasks/all?page=2', '/api/v1.0/tasks/all', '/api/v1.0/tasks?url=rollup'):
+            ApiRequestLog.create(client_ip='127.0.0.1', user_agent='rollup', url=url, method='GET', code=200,
+                                 user_id=1)
+        rollup()
+        rollup()
+        after = api_request_months([month])
+        assert after[0][0] - before[0][0] == 2
+        assert after[1][0] - before[1][0] == 1
@@ -4,8 +4,12 @@
 """
 import pytest
 from flask import url_for
+from webtest import TestApp
 from cronmon import get_config
-from cronmon.models import Permission, User, TaskMonitor
+from cronmon.api.ping import TASK_CACHE, PING_WRITER
+from cronmon.api.fastpath import MonlinkMiddleware
+from cronmon.api.api_1_0.views import API_LOG_WRITER
+from cronmon.models import Permission, User, TaskMonitor, TaskMonitorLog, ApiRequestLog
 
 CFG = get_config()
 SITE_URL = CFG.URL_ROOT.split('/')[2]
@@ -410,6 +414,26 @@ class TestSuperUser:
         res = delete_post(testapp, form.submit(), 'tdel', 'main.tasklist')
         assert u'删除成功' in res
 
+    def test_task_log(self, testapp):
+        """Task log cursor pagination."""
+        login(testapp, 'cronadmin2', 'cronadmin2')
+        task = TaskMonitor.get(TaskMonitor.name == 'thirdTask')
+        for i in range(CFG.ITEMS_PER_PAGE + 1):
+            TaskMonitorLog.create(taskmon_id=task.id, client_ip='10.0.0.%d' % i, user_agent='Curl')
+        url = url_for('main.taskloglist', id=task.id, bid=task.business_id, _external=True, _scheme=SITE_PROTOCOL)
+
+        # Newest logs first, next page continues before the last id of the current page
+        res = testapp.get(url)
+        assert u'10.0.0.%d' % CFG.ITEMS_PER_PAGE in res
+        assert u'10.0.0.0' not in res
+        res = res.click(u'下一页')
+        assert u'10.0.0.0' in res
+        assert u'10.0.0.%d' % CFG.ITEMS_PER_PAGE not in res
+
+        # Date range without logs
+        res = testapp.get(url, {'start': '2000-01-01', 'end': '2000-01-01'})
+        assert u'共0条' in res
+
     def test_system_crud(self, testapp):
         """System Operations."""
         # Login
@@ -846,6 +870,22 @@ class TestApiCall:
         assert u'tasks' in res
         assert res.status_int == 200
 
+        # Get user's all tasks with cursor pagination
+        res = testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/v1.0/tasks/all?after=&length=5&count=1')
+        assert len(res.json['tasks']) == 5
+        assert res.json['count'] == TaskMonitor.select().count()
+        names = [task['name'] for task in res.json['tasks']]
+        while res.json['next']:
+            res = testapp.get(res.json['next'])
+            assert res.json['count'] is None
+            names += [task['name'] for task in res.json['tasks']]
+        assert names == [task.name for task in TaskMonitor.select().order_by(TaskMonitor.id)]
+
+        # Get user's all tasks with incorrect cursor
+        res = testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/v1.0/tasks/all?after=wrong', expect_errors=True)
+        assert u'Invalid Cursor' in res
+        assert res.status_int == 400
+
     def test_task(self, testapp):
         """Test task api call."""
         testapp.authorization = ('Basic', ('api_bizadmin2', 'api_bizadmin2'))
@@ -883,6 +923,10 @@ class TestApiCall:
         res = testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/monlink/'+cronmon_url)
         assert u'OK' in res
         assert res.status_int == 200
+        task = TaskMonitor.get(TaskMonitor.url == cronmon_url)
+        latest = TaskMonitorLog.select().where(TaskMonitorLog.taskmon_id == task.id)\
+            .order_by(TaskMonitorLog.create_datetime.desc()).get()
+        assert task.last_ping_time == latest.create_datetime
 
         # Send request to monitor url with incorrect link
         cronmon_url = 'f9e05ae0-43d2-4753-823a-wrong'
@@ -890,6 +934,82 @@ class TestApiCall:
         assert u'Bad Request' in res
         assert res.status_int == 400
 
+    def test_monitor_url_cache(self, testapp):
+        """Test monitor url lookup cache."""
+        testapp.authorization = None
+        cronmon_url = TaskMonitor.get(TaskMonitor.name == 'thirdTask').url
+        TASK_CACHE.clear()
+        hits, misses = TASK_CACHE.hits, TASK_CACHE.misses
+
+        # First request misses the cache, second request hits it
+        testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/monlink/'+cronmon_url)
+        testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/monlink/'+cronmon_url)
+        assert TASK_CACHE.misses == misses + 1
+        assert TASK_CACHE.hits == hits + 1
+
+        # Unknown uuid is cached as negative lookup
+        cronmon_url = 'f9e05ae0-43d2-4753-823a-wrong'
+        testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/monlink/'+cronmon_url, expect_errors=True)
+        res = testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/monlink/'+cronmon_url, expect_errors=True)
+        assert res.status_int == 400
+        assert TASK_CACHE.get(cronmon_url, False) is None
+
+    def test_monitor_url_buffer(self, testapp, monkeypatch):
+        """Test buffered monitor url logging."""
+        testapp.authorization = None
+        monkeypatch.setattr(CFG, 'MONLINK_BUFFER', True)
+        task = TaskMonitor.get(TaskMonitor.name == 'thirdTask')
+        count = TaskMonitorLog.select().where(TaskMonitorLog.taskmon_id == task.id).count()
+
+        # Pings stay in buffer until flushed
+        res = testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/monlink/'+task.url)
+        assert u'OK' in res
+        PING_WRITER.flush()
+        assert TaskMonitorLog.select().where(TaskMonitorLog.taskmon_id == task.id).count() == count + 1
+        assert TaskMonitor.get_by_id(task.id).last_ping_time >= task.last_ping_time
+
+    def test_monitor_url_fast_path(self, app, testapp, monkeypatch):
+        """Test monitor url fast path responds the same as the flask view, also with pretty printed JSON."""
+        testapp.authorization = None
+        task = TaskMonitor.get(TaskMonitor.name == 'thirdTask')
+        count = TaskMonitorLog.select().where(TaskMonitorLog.taskmon_id == task.id).count()
+
+        for pretty in (False, True):
+            monkeypatch.setitem(app.config, 'JSONIFY_PRETTYPRINT_REGULAR', pretty)
+            fastapp = TestApp(MonlinkMiddleware(app))
+            for cronmon_url in (task.url, task.url.upper(), 'f9e05ae0-43d2-4753-823a-wrong', ''):
+                url = SITE_PROTOCOL+'://'+SITE_URL+'/api/monlink/'+cronmon_url
+                res = testapp.get(url, expect_errors=True)
+                fast_res = fastapp.get(url, expect_errors=True)
+                assert fast_res.status_int == res.status_int
+                assert fast_res.body == res.body
+                assert fast_res.content_type == res.content_type
+        assert TaskMonitorLog.select().where(TaskMonitorLog.taskmon_id == task.id).count() == count + 8
+
+    def test_api_request_log(self, testapp):
+        """Test buffered api request log."""
+        testapp.authorization = ('Basic', ('api_bizadmin2', 'api_bizadmin2'))
+        count = ApiRequestLog.select().count()
+
+        # Request logs are written by the background writer
+        testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/v1.0/tasks/all')
+        API_LOG_WRITER.flush()
+        assert ApiRequestLog.select().count() == count + 1
+
+    def test_stats(self, testapp):
+        """Test stats api call."""
+        # Normal user
+        testapp.authorization = ('Basic', ('api_bizadmin2', 'api_bizadmin2'))
+        res = testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/v1.0/stats', expect_errors=True)
+        assert u'Superuser only' in res
+        assert res.status_int == 403
+
+        # Admin user
+        testapp.authorization = ('Basic', ('api_root2', 'api_pwd2'))
+        res = testapp.get(SITE_PROTOCOL+'://'+SITE_URL+'/api/v1.0/stats')
+        assert u'monlink_cache' in res.json
+        assert res.status_int == 200
+
     def test_incorrect_permissions(self, testapp):
         """Test api call with incorrect permissions"""
         testapp.authorization = ('Basic', ('api_bizadmin2', 'api_bizadmin2pwd'))
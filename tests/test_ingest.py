@@ -0,0 +1,67 @@
+"""独立监控url请求接收服务（cronmon-ingest）测试，使用async语法，Python 3.5.2以下版本不收集此文件（见conftest.py）
+此文件测试用例依赖于初始化脚本中的样本数据，如果数据有过更改，则有可能会导致测试失败
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from cronmon.api.ping import PING_WRITER
+from cronmon.ingest import IngestServer, MAX_HEADER_SIZE
+from cronmon.models import TaskMonitor, TaskMonitorLog
+
+
+async def send_requests(port, requests):
+    """在一个keep-alive连接上依次发送请求
+
+    :param port: 服务端口
+    :param requests: 请求报文列表
+    :return: (状态行, 响应内容)列表
+    """
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    responses = []
+    for request in requests:
+        writer.write(request)
+        head = await reader.readuntil(b'\r\n\r\n')
+        length = int(head.split(b'Content-Length: ')[1].split(b'\r\n')[0])
+        responses.append((head.split(b'\r\n')[0], await reader.readexactly(length)))
+    writer.close()
+    return responses
+
+
+def run_ingest(requests):
+    """启动接收服务（随机端口），发送请求后关闭服务
+
+    :param requests: 请求报文列表
+    :return: 同send_requests
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    ingest = IngestServer(loop, ThreadPoolExecutor(max_workers=2))
+    server = loop.run_until_complete(asyncio.start_server(ingest.handle, '127.0.0.1', 0, limit=MAX_HEADER_SIZE))
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return loop.run_until_complete(send_requests(port, requests))
+    finally:
+        server.close()
+        loop.close()
+
+
+class TestIngest:
+    """cronmon-ingest tests."""
+
+    def test_ingest_server(self):
+        """Test standalone ingest server with keep-alive connection."""
+        task = TaskMonitor.get(TaskMonitor.name == 'thirdTask')
+        count = TaskMonitorLog.select().where(TaskMonitorLog.taskmon_id == task.id).count()
+        responses = run_ingest([('GET /api/monlink/%s HTTP/1.1\r\nHost: ingest\r\n\r\n' % cronmon_url).encode()
+                                for cronmon_url in (task.url, 'f9e05ae0-43d2-4753-823a-wrong', task.url)])
+        assert responses[0] == (b'HTTP/1.1 200 OK', b'OK')
+        assert responses[1][0] == b'HTTP/1.1 400 BAD REQUEST'
+        assert b'Wrong Id' in responses[1][1]
+        PING_WRITER.flush()
+        assert TaskMonitorLog.select().where(TaskMonitorLog.taskmon_id == task.id).count() == count + 2
+
+    def test_ingest_body_limit(self):
+        """Test request body over INGEST_MAX_BODY is rejected and the connection closed."""
+        task = TaskMonitor.get(TaskMonitor.name == 'thirdTask')
+        request = 'POST /api/monlink/%s HTTP/1.1\r\nHost: ingest\r\nContent-Length: 1048576\r\n\r\n' % task.url
+        responses = run_ingest([request.encode()])
+        assert responses[0][0] == b'HTTP/1.1 400 BAD REQUEST'
@@ -4,7 +4,10 @@
 from datetime import datetime
 import pytest
 from werkzeug.security import generate_password_hash
-from cronmon.models import Business, Notifier, BusinessNotifier, TaskMonitor, TaskMonitorLog, Permission, User
+from cronmon.models import DB, Business, Notifier, BusinessNotifier, TaskMonitor, TaskMonitorLog, Permission, User, \
+    UserBusiness
+from cronmon.perm import set_user_business, perm_business
+from cronmon.api.ping import ping_query
 
 
 @pytest.mark.usefixtures('db')
@@ -55,6 +58,21 @@ class TestUserAndPermission:
         assert isinstance(permission.perm_list, str)
         assert isinstance(permission.perm_user, User)
 
+    def test_user_business(self):
+        """Sync user business permissions."""
+        user = User(username='test6', password=generate_password_hash('cronmonpwd'), email='test6@cronmon.com',
+                    phone='13912340006')
+        user.save()
+        business = Business(business_name='biz6')
+        business.save()
+
+        set_user_business(user.id, [str(business.id), '99999'])
+        assert [ub.business.id for ub in UserBusiness.select().where(UserBusiness.user == user.id)] == [business.id]
+        assert Business.select().where(Business.id.in_(perm_business(user.id))).get() == business
+
+        set_user_business(user.id, ['0'])
+        assert UserBusiness.select().where(UserBusiness.user == user.id).count() == 0
+
     def test_check_password(self):
         """Check password."""
         user = User(username='test5', password=generate_password_hash('cronmonpwd'), email='test5@cronmon.com',
@@ -142,6 +160,7 @@ class TestTaskonitorAndLog:
         assert taskmonitor.status is True
         assert taskmonitor.last_check_time is None
         assert taskmonitor.next_check_time is None
+        assert taskmonitor.last_ping_time is None
         assert taskmonitor.warning is False
 
     def test_column_type(self):
@@ -164,3 +183,12 @@ class TestTaskonitorAndLog:
         assert isinstance(taskmonitor_log.client_ip, str)
         assert isinstance(taskmonitor_log.user_agent, str)
         assert isinstance(taskmonitor_log.taskmon_id, int)
+
+    def test_latest_ping_index(self):
+        """Latest ping lookup reads the (taskmon_id, create_datetime) index only."""
+        sql, params = ping_query([1, 2, 3], datetime(2018, 1, 1)).sql()
+        cursor = DB.execute_sql('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        assert plan[0]['key'] == 'taskmonitorlog_taskmon_id_create_datetime'
+        assert 'Using index' in plan[0]['Extra']